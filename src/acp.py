@@ -1,50 +1,257 @@
+"""Normalizes the ACP claims and households by county into one year-partitioned
+Parquet dataset.
+
+Each claims file under ACP_DIR is paired with the households file of the same
+period, e.g. ACP-Claims-by-County-January-August-2023.csv with
+ACP-Households-by-County-January-August-2023.csv. Their headers are matched to
+CLAIMS_COLUMNS and HOUSEHOLDS_COLUMNS by name, whatever their formatting, or failing
+that by position. Claims are streamed in chunks and inner-joined to the households
+on the six county keys, and each pair is written as a part of OUT_DIR/year=<year>.
+
+Parts are keyed by the hash of their source files, so a rerun only processes pairs
+that are new or changed; a part whose period is covered by a newer part of the same
+year (January-August, say, by January-September) is dropped."""
+
+from __future__ import annotations
+
+import argparse
+import datetime
+import pathlib
+import re
+
 import pandas as pd
+import pyarrow.parquet as pq
+
+from src.schemas import ACP_SCHEMA, apply_schema, report_memory
+from src.utils import CHUNKSIZE, arrow_table, file_digest, hash_parts
+
+ACP_DIR = pathlib.Path("data/acp")
+
+OUT_DIR = ACP_DIR / "ACP-Claims-and-Households-by-County"
+
+KEYS = [
+    "Data Month",
+    "State",
+    "State Name",
+    "County Name",
+    "State FIPS",
+    "County FIPS",
+]
+CLAIMS_COLUMNS = KEYS + [
+    "Total Claimed Subscribers",
+    "Total Claimed Devices",
+    "Service Support",
+    "Device Support",
+    "Total Support",
+]
+HOUSEHOLDS_COLUMNS = KEYS + [
+    "Net New Enrollments Alternative Verification Process",
+    "Net New Enrollments Verified by School",
+    "Net New Enrollments Lifeline",
+    "Net New Enrollments National Verifier Application",
+    "Net New Enrollments total",
+    "Total Alternative Verification Process",
+    "Total Verified by School",
+    "Total Lifeline",
+    "Total National Verifier Application",
+    "Total Subscribers",
+]
+
+CLAIMS_GLOB = "ACP-Claims-by-County-*.csv"
+
+# The period of a file, from its name: e.g. January-August-2023, or September-2023.
+PERIOD_PATTERN = re.compile(r"-by-County-([A-Za-z]+)(?:-([A-Za-z]+))?-(\d{4})$")
+
+# Bump whenever the way pairs are normalized changes, to reprocess them all.
+NORMALIZE_VERSION = 1
+
+
+def _month(name: str) -> int:
+    return datetime.datetime.strptime(name, "%B").month
+
+
+def file_period(filepath: pathlib.Path) -> tuple[int, int, int]:
+    """The (year, first month, last month) of an ACP file, from its name; a file of
+    a single month is its first and last."""
+    match = PERIOD_PATTERN.search(filepath.stem)
+    if match is not None:
+        start, end, year = match.groups()
+        try:
+            return int(year), _month(start), _month(end or start)
+        except ValueError:
+            pass  # Not month names.
+
+    raise ValueError(f"Can't tell the period of {filepath.name}")
+
+
+def _covers(period: tuple[int, int, int], other: tuple[int, int, int]) -> bool:
+    year, start, end = period
+    other_year, other_start, other_end = other
+    return year == other_year and start <= other_start <= other_end <= end
+
+
+def discover_pairs(acp_dir: pathlib.Path) -> list[tuple[pathlib.Path, pathlib.Path]]:
+    """The (claims, households) file pairs under acp_dir, oldest period first.
+    A claims file without its households file is skipped, as is one whose name has
+    no period, or whose period another file's covers."""
+    pairs = []
+    for claims_path in acp_dir.glob(CLAIMS_GLOB):
+        try:
+            file_period(claims_path)
+        except ValueError as e:
+            print(f"{e}, skipping it")
+            continue
+
+        households_path = claims_path.with_name(
+            claims_path.name.replace("-Claims-", "-Households-")
+        )
+        if not households_path.exists():
+            print(f"No households file for {claims_path.name}, skipping it")
+            continue
+        pairs.append((claims_path, households_path))
+
+    periods = [file_period(i) for i, _ in pairs]
+    pairs = [
+        pair
+        for pair, period in zip(pairs, periods)
+        if not any(i != period and _covers(i, period) for i in periods)
+    ]
+    return sorted(pairs, key=lambda i: file_period(i[0]))
+
+
+def _normalize_name(name: str) -> str:
+    return re.sub(r"[^a-z0-9]", "", str(name).lower())
+
+
+def header_mapping(columns: list[str], expected: list[str]) -> dict[str, str]:
+    """Renames columns to expected: by name if they match it ignoring case, spacing
+    and punctuation, otherwise by position if there are as many of them."""
+    expected_by_name = {_normalize_name(i): i for i in expected}
+    mapping = {i: expected_by_name.get(_normalize_name(i)) for i in columns}
+
+    if None not in mapping.values() and set(mapping.values()) == set(expected):
+        return mapping
+
+    if len(columns) == len(expected):
+        print(f"Matching header {list(columns)} by position")
+        return dict(zip(columns, expected))
+
+    raise ValueError(f"Can't match header {list(columns)} to {expected}")
+
+
+def read_acp_csv(
+    filepath: pathlib.Path, expected: list[str], chunksize: int | None = None
+):
+    """Reads filepath with its header renamed to expected; in chunks of chunksize
+    rows if it's given."""
+    header = pd.read_csv(filepath, nrows=0).columns
+    mapping = header_mapping(list(header), expected)
+    dtype = {k: ACP_SCHEMA[v] for k, v in mapping.items() if v in ACP_SCHEMA}
+
+    def normalize(df: pd.DataFrame) -> pd.DataFrame:
+        return apply_schema(df.rename(columns=mapping), ACP_SCHEMA)
+
+    if chunksize is None:
+        return normalize(pd.read_csv(filepath, dtype=dtype))
+
+    return (
+        normalize(i) for i in pd.read_csv(filepath, dtype=dtype, chunksize=chunksize)
+    )
+
+
+def part_path(
+    out_dir: pathlib.Path, claims_path: pathlib.Path, households_path: pathlib.Path
+) -> pathlib.Path:
+    """Path of a pair's part, keyed by its files' contents."""
+    year, start, end = file_period(claims_path)
+    key = hash_parts(
+        NORMALIZE_VERSION, file_digest(claims_path), file_digest(households_path)
+    )
+    return out_dir / f"year={year}" / f"{start:02d}-{end:02d}.{key}.parquet"
+
+
+def _part_period(path: pathlib.Path) -> tuple[int, int, int]:
+    start, end = path.name.split(".")[0].split("-")
+    return int(path.parent.name.split("=")[1]), int(start), int(end)
 
 
-claims_columns = "Data Month,State,State Name,County Name,State FIPS,County FIPS,Total Claimed Subscribers,Total Claimed Devices,Service Support,Device Support,Total Support".split(
-    ","
-)
-households_columns = "Data Month,State,State Name,County Name,State FIPS,County FIPS,Net New Enrollments Alternative Verification Process,Net New Enrollments Verified by School,Net New Enrollments Lifeline,Net New Enrollments National Verifier Application,Net New Enrollments total,Total Alternative Verification Process,Total Verified by School,Total Lifeline,Total National Verifier Application,Total Subscribers".split(
-    ","
-)
+def normalize_pair(
+    claims_path: pathlib.Path,
+    households_path: pathlib.Path,
+    out_path: pathlib.Path,
+    chunksize: int = CHUNKSIZE,
+) -> int:
+    """Joins a pair's claims to its households, chunk by chunk, appending each joined
+    chunk to the part at out_path. Returns the number of rows written."""
+    households_df = read_acp_csv(households_path, HOUSEHOLDS_COLUMNS)
 
-# Normalize ACP data to include households and counties in one file
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    # Hidden until complete, so that a failed write isn't read as part of the dataset.
+    tmp_path = out_path.with_name(f".{out_path.name}.tmp")
 
-# 2023 data's header is formatted differently
+    writer = None
+    n_rows = 0
+    try:
+        for chunk in read_acp_csv(claims_path, CLAIMS_COLUMNS, chunksize=chunksize):
+            df = pd.merge(chunk, households_df, on=KEYS, how="inner")
 
+            table = arrow_table(df)
+            if writer is None:
+                writer = pq.ParquetWriter(tmp_path, table.schema, compression="zstd")
+            writer.write_table(table.cast(writer.schema))
+            n_rows += len(df)
+    finally:
+        if writer is not None:
+            writer.close()
 
-# claims_path = "data/acp/ACP-Claims-by-County-January-August-2023.csv"
-# households_path = "data/acp/ACP-Households-by-County-January-August-2023.csv"
+    if writer is None:
+        raise ValueError(f"{claims_path.name} has no rows")
 
-claims_path = "data/acp/ACP-Claims-by-County-January-December-2022.csv"
-households_path = "data/acp/ACP-Households-by-County-January-December-2022.csv"
+    tmp_path.replace(out_path)
+    return n_rows
 
-claims_df = pd.read_csv(claims_path)
-households_df = pd.read_csv(households_path)
 
-claims_df.columns = claims_columns
-households_df.columns = households_columns
+def normalize_dir(
+    acp_dir: pathlib.Path = ACP_DIR,
+    out_dir: pathlib.Path = OUT_DIR,
+    chunksize: int = CHUNKSIZE,
+) -> list[pathlib.Path]:
+    """Normalizes each new or changed pair under acp_dir into out_dir, dropping the
+    parts it supersedes. Returns the paths of the parts written."""
+    written = []
 
+    for claims_path, households_path in discover_pairs(acp_dir):
+        out_path = part_path(out_dir, claims_path, households_path)
+        if out_path.exists():
+            continue
 
-on = "Data Month,State,State Name,County Name,State FIPS,County FIPS".split(",")
+        n_rows = normalize_pair(claims_path, households_path, out_path, chunksize)
+        print(f"Wrote {n_rows} rows of {claims_path.name} to {out_path}")
+        written.append(out_path)
 
-df = pd.merge(claims_df, households_df, left_on=on, right_on=on, how="inner")
+        # Drop the parts of this period's earlier versions, and of the periods it covers.
+        period = _part_period(out_path)
+        for other_path in out_path.parent.glob("*.parquet"):
+            if other_path != out_path and _covers(period, _part_period(other_path)):
+                print(f"Dropping {other_path}, superseded by {out_path.name}")
+                other_path.unlink()
 
-df.to_csv(
-    "data/acp/ACP-Claims-and-Households-by-County-January-December-2022.csv",
-    index=False,
-)
+    return written
 
-# stack years of normalized data
 
-df_2022 = pd.read_csv(
-    "data/acp/ACP-Claims-and-Households-by-County-January-December-2022.csv"
-)
-df_2023 = pd.read_csv(
-    "data/acp/ACP-Claims-and-Households-by-County-January-August-2023.csv"
-)
+def read_acp(out_dir: pathlib.Path = OUT_DIR, years: list[int] | None = None):
+    """The normalized ACP data, of only years if they're given."""
+    filters = [("year", "in", years)] if years is not None else None
+    df = pd.read_parquet(out_dir, filters=filters)
+    df = df.drop(columns=["year"])
+    return apply_schema(df, ACP_SCHEMA)
 
 
-df = pd.concat([df_2022, df_2023])
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--acp-dir", type=pathlib.Path, default=ACP_DIR)
+    parser.add_argument("--out-dir", type=pathlib.Path, default=OUT_DIR)
+    args = parser.parse_args()
 
-df.to_csv("data/acp/ACP-Claims-and-Households-by-County.csv", index=False)
+    normalize_dir(args.acp_dir, args.out_dir)
+    report_memory(read_acp(args.out_dir), "ACP")
@@ -0,0 +1,159 @@
+"""Times the pipeline's hot paths on synthetic inputs of increasing size, offline.
+
+    python -m src.benchmark --sizes 10000 100000 1000000 10000000
+
+Inputs are generated once per size and seed under --root (see src.synthetic), and
+reused by later runs. The timings of each run are written as JSON to BENCHMARK_DIR,
+timestamped, so that runs can be compared over time.
+
+The same benchmarks run under pytest-benchmark, at the sizes in the BENCHMARK_SIZES
+environment variable (see tests/test_benchmark.py):
+
+    pytest -m benchmark"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import pathlib
+import statistics
+import time
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+from src.ecf_dedup import (
+    BEN,
+    build_supp_store,
+    dedeup_frns,
+    join_nslp,
+    load_ecf_data,
+    lookup_supp_data,
+)
+from src.spatial import spatial_join
+from src.synthetic import write_inputs
+from src.utils import merge_n_drop, range_join
+
+BENCHMARK_DIR = pathlib.Path("data/benchmarks")
+
+SIZES = [10_000, 100_000, 1_000_000, 10_000_000]
+
+
+@contextlib.contextmanager
+def _chdir(path: pathlib.Path):
+    """The pipeline reads some lookups from paths relative to the working directory."""
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
+
+
+def _intervals(n: int, rng: np.random.Generator) -> pd.DataFrame:
+    lo = rng.random(n)
+    return pd.DataFrame({"lo": lo, "hi": lo + rng.random(n) / n, "value": np.arange(n)})
+
+
+def benchmarks() -> dict[str, Callable[[], object]]:
+    """Each benchmark of the inputs in the working directory, as a thunk to be timed."""
+    ecf_df = load_ecf_data(pathlib.Path("data/ecf.csv"))
+    supp_df = lookup_supp_data(build_supp_store(pathlib.Path("data/supp.csv")))
+    mapped_df = merge_n_drop(ecf_df, supp_df, left_on=BEN, right_on="Entity Number")
+    intervals_df = _intervals(max(10, len(ecf_df) // 100), np.random.default_rng(0))
+
+    return {
+        "dedeup_frns": lambda: dedeup_frns(ecf_df),
+        "range_join": lambda: range_join(
+            ecf_df, intervals_df, left_on="NSLP Percentage", right_on=("lo", "hi")
+        ),
+        "merge_n_drop": lambda: merge_n_drop(
+            ecf_df,
+            supp_df,
+            left_on=BEN,
+            right_on="Entity Number",
+            how="left",
+        ),
+        "merge_n_drop (plan)": lambda: merge_n_drop(
+            ecf_df,
+            supp_df,
+            left_on=BEN,
+            right_on="Entity Number",
+            how="left",
+            plan=True,
+        ),
+        "join_nslp": lambda: join_nslp(mapped_df),
+        "spatial_join": lambda: spatial_join(
+            mapped_df, school_districts_path=pathlib.Path("data/districts.zip")
+        ),
+    }
+
+
+def prepare(size: int, root: pathlib.Path, seed: int = 0) -> pathlib.Path:
+    """The directory of the inputs of size rows, generating them if they don't exist."""
+    size_root = pathlib.Path(root).resolve() / f"{size}-{seed}"
+    if not (size_root / "data").exists():
+        print(f"Generating {size} rows under {size_root}")
+        write_inputs(size_root, n_rows=size, seed=seed)
+    return size_root
+
+
+def time_thunk(thunk: Callable[[], object], repeat: int) -> dict[str, float]:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        thunk()
+        times.append(time.perf_counter() - start)
+
+    return {"best_s": min(times), "median_s": statistics.median(times)}
+
+
+def run(
+    sizes: list[int] = SIZES,
+    root: pathlib.Path = pathlib.Path("data/synthetic"),
+    seed: int = 0,
+    repeat: int = 3,
+    only: list[str] | None = None,
+) -> dict[int, dict[str, dict[str, float]]]:
+    """Times each benchmark (or those named in only) at each size, best of repeat."""
+    results = {}
+
+    for size in sizes:
+        with _chdir(prepare(size, root, seed)):
+            results[size] = {}
+            for name, thunk in benchmarks().items():
+                if only is not None and name not in only:
+                    continue
+
+                results[size][name] = time_thunk(thunk, repeat=repeat)
+                print(f"{size:>12,} {name:<24} {results[size][name]['best_s']:.3f}s")
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--root", type=pathlib.Path, default="data/synthetic")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--only", nargs="+", default=None)
+    args = parser.parse_args()
+
+    results = run(
+        sizes=args.sizes,
+        root=args.root,
+        seed=args.seed,
+        repeat=args.repeat,
+        only=args.only,
+    )
+
+    BENCHMARK_DIR.mkdir(parents=True, exist_ok=True)
+    started = datetime.datetime.now().strftime("%Y%m%dT%H%M%S")
+    report_path = BENCHMARK_DIR / f"benchmark-{started}.json"
+    report_path.write_text(json.dumps(results, indent=2))
+    print(f"Wrote {report_path}")
@@ -0,0 +1,146 @@
+"""Uploads of the pipeline's artifacts to a Drive folder.
+
+Each artifact is sent in a resumable session of CHUNK_SIZE chunks; a chunk that
+fails is retried with backoff, resuming from the last byte Drive confirmed rather
+than from zero. The artifact may be gzipped first. The hash of its contents is
+stored in the Drive file's appProperties, so an artifact unchanged since its last
+upload is never re-sent. Several artifacts are uploaded concurrently.
+
+Only Drive's files resource is used (list, create and update), so a local
+stand-in can take its place."""
+
+from __future__ import annotations
+
+import gzip
+import mimetypes
+import pathlib
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+import googleapiclient.http
+
+from src.utils import DOWNLOAD_CHUNKSIZE, file_digest, with_retry
+
+# Size of each chunk of a resumable upload; Drive requires a multiple of 256 KiB.
+CHUNK_SIZE = 8 * DOWNLOAD_CHUNKSIZE
+
+# Key of the hash of an artifact's contents, in its Drive file's appProperties.
+DIGEST_PROPERTY = "contentDigest"
+
+# MIME types of compressed files, by the encoding mimetypes.guess_type gives them.
+ENCODING_MIMETYPES = {"gzip": "application/gzip"}
+
+
+def compress(filepath: pathlib.Path, out_dir: pathlib.Path) -> pathlib.Path:
+    """Gzips filepath into out_dir. The archive's mtime is fixed, so that the same
+    contents always compress to the same bytes."""
+    out_path = out_dir / f"{filepath.name}.gz"
+    with open(filepath, "rb") as f, gzip.GzipFile(out_path, "wb", mtime=0) as out:
+        shutil.copyfileobj(f, out, DOWNLOAD_CHUNKSIZE)
+    return out_path
+
+
+def find_file(files: Any, name: str, folder_id: str) -> dict | None:
+    """The Drive file named name in folder_id, if any."""
+    query = f"name = '{name}' and '{folder_id}' in parents and trashed = false"
+    response = with_retry(
+        lambda: files.list(
+            q=query,
+            fields="files(id, name, appProperties)",
+            includeItemsFromAllDrives=True,
+            supportsAllDrives=True,
+        ).execute()
+    )
+    return next(iter(response.get("files", [])), None)
+
+
+def guess_mimetype(name: str) -> str:
+    """The MIME type of a file called name: that of its compression if it has one,
+    as a compressed file isn't readable as what it contains."""
+    mimetype, encoding = mimetypes.guess_type(name)
+    if encoding is not None:
+        return ENCODING_MIMETYPES.get(encoding, "application/octet-stream")
+    return mimetype or "application/octet-stream"
+
+
+def upload_resumable(request: Any) -> dict:
+    """Runs the resumable upload request chunk by chunk to completion. After a failed
+    chunk, the next call to next_chunk resumes from what Drive confirmed it has."""
+    response = None
+    while response is None:
+        status, response = with_retry(request.next_chunk)
+        if status is not None:
+            print(f"Uploaded {status.progress():.0%}")
+    return response
+
+
+def upload_artifact(
+    files: Any,
+    filepath: pathlib.Path,
+    folder_id: str,
+    gzipped: bool = False,
+    chunk_size: int = CHUNK_SIZE,
+) -> dict | None:
+    """Uploads filepath to folder_id, replacing any file of the same name there,
+    unless that file's contents are unchanged. If gzipped, it's uploaded as
+    filepath.gz. Returns the uploaded Drive file, or None if none was sent."""
+    filepath = pathlib.Path(filepath)
+    name = f"{filepath.name}.gz" if gzipped else filepath.name
+
+    digest = file_digest(filepath)
+    existing = find_file(files, name, folder_id)
+    if (
+        existing is not None
+        and existing.get("appProperties", {}).get(DIGEST_PROPERTY) == digest
+    ):
+        print(f"Skipping upload of unchanged {name}")
+        return None
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        upload_path = compress(filepath, pathlib.Path(tmp_dir)) if gzipped else filepath
+
+        media = googleapiclient.http.MediaFileUpload(
+            str(upload_path),
+            mimetype=guess_mimetype(name),
+            chunksize=chunk_size,
+            resumable=True,
+        )
+        body = {"name": name, "appProperties": {DIGEST_PROPERTY: digest}}
+
+        if existing is not None:
+            request = files.update(
+                fileId=existing["id"],
+                body=body,
+                media_body=media,
+                supportsAllDrives=True,
+            )
+        else:
+            request = files.create(
+                body={**body, "parents": [folder_id]},
+                media_body=media,
+                supportsAllDrives=True,
+            )
+
+        print(f"Uploading {name}")
+        return upload_resumable(request)
+
+
+def upload_artifacts(
+    files_factory: Callable[[], Any],
+    filepaths: list[pathlib.Path],
+    folder_id: str,
+    gzipped: bool = False,
+    max_workers: int = 4,
+) -> list[dict | None]:
+    """Uploads each of filepaths as in upload_artifact, concurrently.
+
+    API clients aren't thread-safe, so files_factory makes a files resource for each
+    upload, e.g. lambda: Drive(creds).files."""
+
+    def upload(filepath: pathlib.Path) -> dict | None:
+        return upload_artifact(files_factory(), filepath, folder_id, gzipped=gzipped)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(upload, filepaths))
@@ -1,18 +1,80 @@
 from __future__ import annotations
 
+import functools
+import json
+import multiprocessing
+import os
 import pathlib
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Literal, NamedTuple
 
-import geopandas as gpd
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 from googleapiutils2 import Drive, get_oauth2_creds
-
-from src.utils import GET_if_not_exists, merge_n_drop, range_join
+from googleapiutils2.utils import parse_file_id
+
+from src.drive_upload import upload_artifacts
+from src.form_471_dedup import RAW_PATH, dedup_form_471
+from src.pipeline import Stage, code_version, run_stages, stage_keys
+from src.profiling import Profiler
+from src.spatial import (
+    DISTRICT_COLUMNS,
+    load_district_index,
+    prepare_district_index,
+    spatial_join,
+)
+from src.schemas import (
+    DISCOUNT_MATRIX_SCHEMA,
+    ECF_SCHEMA,
+    FORM_471_SCHEMA,
+    SCHEMA_VERSION,
+    STATE_NAMES_SCHEMA,
+    SUPP_SCHEMA,
+    apply_schema,
+    report_memory,
+)
+from src.utils import (
+    GET_if_not_exists,
+    OutputFormat,
+    check_columns,
+    concat_frames,
+    file_fingerprint,
+    frame_fingerprint,
+    cache_filepath,
+    hash_parts,
+    merge_n_drop,
+    range_join,
+    read_cached,
+    read_csv_chunked,
+    write_cache,
+    write_output,
+)
 
 PK = ["Funding Request Number (FRN)", "FRN Line Item ID", "Funding Request Status"]
 
+# Rows sharing an FRN group are de-duplicated together, and so are (re)processed together.
+FRN_GROUP = ["Funding Request Number (FRN)", "FRN Line Item ID"]
+
+# Rank of each "Funding Request Status" when de-duplicating an (FRN, FRN Line Item) pair;
+# lower ranks lose to higher ones. Statuses not listed rank DEFAULT_STATUS_RANK; those
+# ranked below it (like "Pending") are duplicates of another row of their pair.
+STATUS_PRECEDENCE = {"Pending": 0}
+DEFAULT_STATUS_RANK = 1
+
 
 OUT_FILEPATH = pathlib.Path("data/ECF Deduped.csv")
 
+FIRMS_FILEPATH = pathlib.Path("data/ECF Consulting Firms.csv")
+
+# Each pipeline stage's last output; see run_stages.
+CHECKPOINT_DIR = pathlib.Path("data/ECF Checkpoints")
+
+# Signatures of the last processed ECF pull, and its materialized output.
+SNAPSHOT_DIR = pathlib.Path("data/ECF Snapshot")
+
 ECF_FOLDER_URL = (
     "https://drive.google.com/drive/u/0/folders/1fB2mj-hl7KIduiNidbWLlMAFXZ76GmN8"
 )
@@ -27,31 +89,224 @@ SCHOOL_DISTRICTS_URL = (
     "https://nces.ed.gov/programs/edge/data/EDGESCHOOLDISTRICT_TL21_SY2021.zip"
 )
 
+STATE_NAMES_PATH = pathlib.Path("data/us-states-names.csv")
+
+# The raw Form 471 basic information, deduplicated by BEN as it's read.
+FORM_471_PATH = RAW_PATH
+
+DISCOUNT_MATRIX_PATH = pathlib.Path("data/ECF Discount Matrix.csv")
+
+BEN = "Billed Entity Number (BEN)"
+
+# Each BEN's located district, per district vintage; see spatial_join.
+BEN_DISTRICTS_DIR = pathlib.Path("data/BEN Districts")
+
+SUPP_STORE_ROW_GROUP_SIZE = 10_000
+
+# The modules of the code the stages run, beyond their own fn: a change to any of them
+# invalidates every checkpoint, and the incremental snapshot.
+PIPELINE_MODULES = [
+    "src.ecf_dedup",
+    "src.form_471_dedup",
+    "src.schemas",
+    "src.spatial",
+    "src.utils",
+]
+
+# Position of each row in the ECF frame, while it's processed in shards.
+ROW_COL = "_row"
+
+# Free-text ECF columns that are never read; they're emptied in the output.
+ECF_OMIT_COLUMNS = ["Funding Request Narrative"]
+
+
+class StageColumns(NamedTuple):
+    """The ECF columns a stage reads (needs), and the columns it adds to the
+    ECF frame (outputs) from its own source, joined on that source's key column."""
+
+    needs: list[str]
+    key: str | None = None
+    outputs: list[str] | None = None
+
+    @property
+    def usecols(self) -> list[str] | None:
+        """Columns to read from the stage's source; None reads every column."""
+        if self.outputs is None:
+            return None
+        return ([self.key] if self.key is not None else []) + self.outputs
+
+
+MAP_BENS_COLUMNS = StageColumns(
+    needs=[BEN],
+    key="Entity Number",
+    outputs=[
+        "Entity Name",
+        "Entity Type",
+        "Parent Entity Number",
+        "Parent Entity Name",
+        "Physical County",
+        "Latitude",
+        "Longitude",
+        "Urban/ Rural Status",
+        "NSLP Percentage",
+        "Total Number of Full-Time Students",
+        "Total Number of Part-Time Students",
+        "Peak Number of Part-Time Students",
+        "Number of NSLP Students",
+    ],
+)
+
+DEDUP_COLUMNS = StageColumns(
+    needs=[*PK, "Consulting Firm"],
+    outputs=["Consulting Firm Names", "Consulting Firm Numbers"],
+)
+
+STATE_NAMES_COLUMNS = StageColumns(
+    needs=["Billed Entity State"], key="Abbreviation", outputs=["Name"]
+)
+
+FORM_471_COLUMNS = StageColumns(
+    needs=[BEN],
+    key="Billed Entity Number",
+    outputs=["Funding Year", "Category One Discount Rate"],
+)
+
+SPATIAL_COLUMNS = StageColumns(
+    needs=[BEN, "Latitude", "Longitude"], outputs=list(DISTRICT_COLUMNS.values())
+)
+
+# The discount matrix is tiny, and is read whole.
+NSLP_COLUMNS = StageColumns(needs=["NSLP Percentage", "Urban/ Rural Status"])
+
 
-def upload_sheet(filepath: pathlib.Path):
+def upload_sheet(filepaths: list[pathlib.Path], gzipped: bool = False):
+    """Uploads each of filepaths to the ECF folder, concurrently, skipping those
+    unchanged since their last upload; see src.drive_upload."""
     client_config_path = pathlib.Path("auth/creds.json")
 
     creds = get_oauth2_creds(client_config=client_config_path)
-    drive = Drive(creds)
 
-    drive.upload_file(filepath=filepath, parents=[ECF_FOLDER_URL])
+    upload_artifacts(
+        lambda: Drive(creds).files,
+        filepaths,
+        folder_id=parse_file_id(ECF_FOLDER_URL),
+        gzipped=gzipped,
+    )
+
 
+def read_ecf_data(ecf_filepath: pathlib.Path):
+    ecf_df = read_csv_chunked(
+        ecf_filepath,
+        dtype=ECF_SCHEMA,
+        usecols=lambda x: x not in ECF_OMIT_COLUMNS,
+    )
+    report_memory(ecf_df, "ECF")
 
-def get_ecf_data(ecf_filepath: str | None = None):
+    return ecf_df
+
+
+def fetch_ecf_data(ecf_filepath: str | None = None) -> pathlib.Path:
     ecf_filepath, _ = GET_if_not_exists(
         url=ECF_URL, filepath=ecf_filepath, days_until_stale=3, suffix=".csv"
     )
-    ecf_df = pd.read_csv(ecf_filepath)
-    ecf_df["Funding Request Narrative"] = ""
+    return ecf_filepath
+
+
+def load_ecf_data(ecf_filepath: pathlib.Path):
+    ecf_df = read_cached(
+        ecf_filepath,
+        reader=read_ecf_data,
+        version=hash_parts(SCHEMA_VERSION, ECF_SCHEMA, ECF_OMIT_COLUMNS),
+    )
+    ecf_df = apply_schema(ecf_df, ECF_SCHEMA)
+    ecf_df[ECF_OMIT_COLUMNS] = ""
 
     return ecf_df
 
 
-def get_supp_data(supp_path: str | None = None):
-    supp_path, downloaded = GET_if_not_exists(
+def get_ecf_data(ecf_filepath: str | None = None):
+    return load_ecf_data(fetch_ecf_data(ecf_filepath))
+
+
+def last_per_entity(supp_df: pd.DataFrame) -> pd.DataFrame:
+    """Last non-null value of each column per "Entity Number"; applying this
+    to consecutive chunks and then to their concatenation equals applying it once."""
+    return (
+        supp_df.groupby("Entity Number", as_index=False).last().reset_index(drop=True)
+    )
+
+
+def read_supp_data(supp_path: pathlib.Path, columns: list[str] | None = None):
+    # Each chunk is reduced to its last entry per entity as it's read.
+    supp_df = read_csv_chunked(
+        supp_path,
+        dtype=SUPP_SCHEMA,
+        usecols=(lambda x: x in columns) if columns is not None else None,
+        chunk_fn=last_per_entity,
+    )
+    supp_df = last_per_entity(supp_df)
+    report_memory(supp_df, "Supplemental")
+
+    return supp_df
+
+
+def fetch_supp_data(supp_path: str | None = None) -> pathlib.Path:
+    supp_path, _ = GET_if_not_exists(
         url=ERATE_SUPP_URL, filepath=supp_path, days_until_stale=7, suffix=".csv"
     )
-    supp_df = pd.read_csv(supp_path)
+    return supp_path
+
+
+def build_supp_store(
+    supp_path: pathlib.Path,
+    columns: list[str] | None = MAP_BENS_COLUMNS.usecols,
+) -> pathlib.Path:
+    """Builds the supplemental entity store of supp_path once per download: a Parquet copy,
+    sorted by "Entity Number" and split into row groups of SUPP_STORE_ROW_GROUP_SIZE,
+    whose statistics let lookup_supp_data skip the row groups that can't contain
+    the entities it's after."""
+    store_path = cache_filepath(
+        supp_path, version=hash_parts(SCHEMA_VERSION, SUPP_SCHEMA, columns)
+    )
+
+    if not store_path.exists():
+        # last_per_entity leaves the frame sorted by "Entity Number".
+        supp_df = read_supp_data(supp_path, columns=columns)
+        if not write_cache(
+            supp_df,
+            supp_path,
+            store_path,
+            row_group_size=SUPP_STORE_ROW_GROUP_SIZE,
+        ):
+            raise ValueError(f"Could not build the supplemental store of {supp_path}")
+
+    return store_path
+
+
+def prepare_supp_store(supp_path: pathlib.Path) -> pathlib.Path:
+    """Builds the supplemental entity store of supp_path, if need be."""
+    build_supp_store(supp_path)
+    return pathlib.Path(supp_path)
+
+
+def lookup_supp_data(store_path: pathlib.Path, bens: pd.Series | None = None):
+    """The supplemental entities of the given BENs; a semi-join against the store,
+    which only reads the row groups that might contain them. None reads every entity."""
+    filters = None
+    if bens is not None:
+        filters = [("Entity Number", "in", bens.dropna().unique().tolist())]
+
+    supp_df = pd.read_parquet(store_path, filters=filters, memory_map=True)
+    return apply_schema(supp_df, SUPP_SCHEMA)
+
+
+def get_supp_data(
+    supp_path: str | None = None,
+    bens: pd.Series | None = None,
+    columns: list[str] | None = MAP_BENS_COLUMNS.usecols,
+):
+    store_path = build_supp_store(fetch_supp_data(supp_path), columns=columns)
+    supp_df = lookup_supp_data(store_path, bens=bens)
 
     # # if not downloaded:
     # #     return supp_df
@@ -78,89 +333,154 @@ def get_supp_data(supp_path: str | None = None):
     #     dup_cols_to_keep="left",
     # )
 
-    supp_df = (
-        supp_df.groupby("Entity Number", as_index=False).last().reset_index(drop=True)
-    )
-    supp_df.to_csv(supp_path, index=False)
     return supp_df
 
 
-def get_school_districts_data(school_districts_path: str | None = None):
+def fetch_school_districts_data(
+    school_districts_path: str | None = None,
+) -> pathlib.Path:
     school_districts_path, _ = GET_if_not_exists(
         url=SCHOOL_DISTRICTS_URL, filepath=school_districts_path, suffix=".zip"
     )
-    gdf = gpd.read_file(school_districts_path)
-    return gdf
+    return school_districts_path
+
+
+def load_school_districts_data(school_districts_path: pathlib.Path):
+    return load_district_index(school_districts_path)
+
+
+def get_school_districts_data(school_districts_path: str | None = None):
+    return load_school_districts_data(
+        fetch_school_districts_data(school_districts_path)
+    )
+
+
+def join_school_districts(
+    ecf_df: pd.DataFrame, school_districts_path: pathlib.Path
+) -> pd.DataFrame:
+    """Most reliable method to map a school-like entity to a given district;
+    100% of the supplemental E-rate data contain coordinates for the included schools."""
+    check_columns(ecf_df, SPATIAL_COLUMNS.needs, stage="join_school_districts")
+
+    return spatial_join(
+        ecf_df,
+        school_districts_path=school_districts_path,
+        key=BEN,
+        lookup_dir=BEN_DISTRICTS_DIR,
+    )
 
 
 def map_bens(ecf_df: pd.DataFrame, supp_df: pd.DataFrame):
+    check_columns(ecf_df, MAP_BENS_COLUMNS.needs, stage="map_bens")
+
     ecf_df = merge_n_drop(
         ecf_df,
         supp_df,
-        left_on="Billed Entity Number (BEN)",
+        left_on=BEN,
         right_on="Entity Number",
         how="left",
+        plan=True,
     )
 
     return ecf_df
 
 
-def spatial_join(df: pd.DataFrame, school_districts_gdf: gpd.GeoDataFrame):
-    """Most reliable method to map a school-like entity to a given district;
-    100% of the supplemental E-rate data contain coordinates for the included schools."""
-    gdf = gpd.GeoDataFrame(
-        df, geometry=gpd.points_from_xy(df.Longitude, df.Latitude), crs="EPSG:4269"
+def parse_consulting_firms(firms: pd.Series) -> pd.DataFrame:
+    """Parses "Consulting Firm" entries, formatted as "{name|number},{name|number}",
+    into one row per firm, indexed by the label of the entry it came from."""
+    items = firms.dropna().str.split("},").explode()
+
+    parsed = items.str.replace("[{}]", "", regex=True).str.extract(
+        r"^([^|]*)\|([^|]*)$"
     )
-    gdf = gdf.sjoin(school_districts_gdf, how="left")
-    df = pd.DataFrame(gdf.drop(columns="geometry"))
-    return df
+    parsed.columns = ["Consulting Firm Name", "Consulting Firm Number"]
 
+    if (malformed := parsed["Consulting Firm Name"].isna()).any():
+        raise ValueError(
+            f"Malformed Consulting Firm entries: {items[malformed].unique().tolist()}"
+        )
+
+    return parsed
 
-def dedeup_frns(ecf_df: pd.DataFrame):
-    """Removes duplicated rows based on each pair of (FRN, FRN Line Item).
-    If an entry contains a status of 'Pending' in addition to any other status,
-    the 'Pending' entry is removed; this row is duplicated in regards to
-    calculating the Line Total Cost."""
-    frns = ecf_df.groupby(["Funding Request Number (FRN)", "FRN Line Item ID"])
 
-    drop_ixs = []
+def join_consulting_firms(firms: pd.Series) -> pd.DataFrame:
+    """The names and the numbers of the firms of each "Consulting Firm" entry, each
+    joined by ", ", indexed by the label of the entry. Parsed as by
+    parse_consulting_firms, but with Arrow's string kernels over the whole column
+    rather than by the row of each firm."""
+    firms = firms.dropna()
+    entries = pa.array(firms.to_numpy(dtype=object), type=pa.string())
 
-    for frn, group_df in frns:
-        statuses = group_df["Funding Request Status"]
-        statuses_list = list(statuses)
+    items = pc.split_pattern(entries, "},")
+    items_flat = pc.replace_substring(items.flatten(), "{", "")
+    parts = pc.split_pattern(pc.replace_substring(items_flat, "}", ""), "|")
 
-        if "Pending" in statuses_list and len(statuses_list) > 1:
-            pending_ixs = statuses[statuses == "Pending"].index
-            drop_ixs.extend(pending_ixs)
+    malformed = pc.not_equal(pc.list_value_length(parts), 2)
+    if pc.any(malformed).as_py():
+        raise ValueError(
+            "Malformed Consulting Firm entries: "
+            f"{pc.filter(items_flat, malformed).unique().to_pylist()}"
+        )
 
-    ecf_df = ecf_df.drop(drop_ixs, axis=0)
+    return pd.DataFrame(
+        {
+            column: pc.binary_join(
+                pa.ListArray.from_arrays(items.offsets, pc.list_element(parts, i)),
+                ", ",
+            ).to_pandas()
+            for i, column in enumerate(
+                ["Consulting Firm Names", "Consulting Firm Numbers"]
+            )
+        }
+    ).set_axis(firms.index)
 
-    def split_firms(x: str):
-        items = x.split("},")
 
-        names, numbers = [], []
+def consulting_firms_table(ecf_df: pd.DataFrame) -> pd.DataFrame:
+    """One row per (FRN, consulting firm), for aggregating by firm."""
+    frn = "Funding Request Number (FRN)"
+    check_columns(ecf_df, [frn, "Consulting Firm"], stage="consulting_firms_table")
 
-        for i in items:
-            i = i.replace("{", "").replace("}", "")
-            name, number = i.split("|")
+    firms = parse_consulting_firms(ecf_df["Consulting Firm"])
+    firms.insert(0, frn, ecf_df.loc[firms.index, frn])
 
-            names.append(name)
-            numbers.append(number)
+    return firms.drop_duplicates().reset_index(drop=True)
 
-        return ", ".join(names), ", ".join(numbers)
 
-    firm_ixs = ~ecf_df["Consulting Firm"].isnull()
-    firms = ecf_df.loc[firm_ixs, "Consulting Firm"]
+def dedeup_frns(
+    ecf_df: pd.DataFrame, status_precedence: dict[str, int] = STATUS_PRECEDENCE
+):
+    """Removes duplicated rows based on each pair of (FRN, FRN Line Item).
+    Each row's 'Funding Request Status' is ranked by status_precedence
+    (statuses not in the table rank DEFAULT_STATUS_RANK). Within a pair of more than
+    one row, every row ranked below the pair's highest-ranked status is removed, and
+    so is every row ranked below DEFAULT_STATUS_RANK, even if the whole pair is.
 
-    (
-        ecf_df.loc[firm_ixs, "Consulting Firm Names"],
-        ecf_df.loc[firm_ixs, "Consulting Firm Numbers"],
-    ) = zip(*firms.apply(split_firms))
+    By default, if an entry contains a status of 'Pending' in addition to any other status,
+    the 'Pending' entry is removed; this row is duplicated in regards to
+    calculating the Line Total Cost. Rows with a missing FRN or line item are kept."""
+    check_columns(ecf_df, DEDUP_COLUMNS.needs, stage="dedeup_frns")
+
+    # Mapped as objects: mapping a categorical to ranks yields an unordered categorical.
+    statuses = ecf_df["Funding Request Status"].astype(object)
+    ranks = statuses.map(status_precedence).fillna(DEFAULT_STATUS_RANK).astype(float)
+
+    groups = ranks.groupby([ecf_df[i] for i in FRN_GROUP])
+    max_ranks, sizes = groups.transform("max"), groups.transform("size")
+
+    dropped = (sizes > 1) & ((ranks < max_ranks) | (ranks < DEFAULT_STATUS_RANK))
+    ecf_df = ecf_df.drop(ecf_df.index[dropped], axis=0)
+
+    joined = join_consulting_firms(ecf_df["Consulting Firm"])
+
+    ecf_df["Consulting Firm Names"] = joined["Consulting Firm Names"]
+    ecf_df["Consulting Firm Numbers"] = joined["Consulting Firm Numbers"]
 
     return ecf_df
 
 
 def join_nslp(ecf_df: pd.DataFrame):
+    check_columns(ecf_df, NSLP_COLUMNS.needs, stage="join_nslp")
+
     def nslp_range_split(x: str):
         lo, hi = x, x
 
@@ -171,7 +491,9 @@ def join_nslp(ecf_df: pd.DataFrame):
 
         return lo, hi
 
-    discount_df = pd.read_csv("data/ECF Discount Matrix.csv")
+    discount_df = pd.read_csv(
+        DISCOUNT_MATRIX_PATH, usecols=NSLP_COLUMNS.usecols, dtype=DISCOUNT_MATRIX_SCHEMA
+    )
 
     range_col = "NSLP Percent"
     range_col_low, range_col_high = range_col + "_low", range_col + "_high"
@@ -180,31 +502,147 @@ def join_nslp(ecf_df: pd.DataFrame):
         *discount_df[range_col].apply(nslp_range_split)
     )
 
-    tmps = [ecf_df[ecf_df["Urban/ Rural Status"].isna()]]
+    return range_join(
+        left=ecf_df,
+        right=discount_df,
+        left_on="NSLP Percentage",
+        right_on=(range_col_low, range_col_high),
+        left_by="Urban/ Rural Status",
+        right_by="Rural/Urban",
+    )
+
+
+def read_form_471_data(form_471_path: pathlib.Path, columns: list[str] | None = None):
+    form_471_df = read_csv_chunked(
+        form_471_path,
+        dtype=FORM_471_SCHEMA,
+        usecols=(lambda x: x in columns) if columns is not None else None,
+    )
+    report_memory(form_471_df, "Form 471")
+
+    return form_471_df
+
+
+def read_raw_form_471_data(
+    form_471_path: pathlib.Path, columns: list[str] | None = None
+):
+    form_471_df = dedup_form_471(form_471_path, usecols=columns)
+    report_memory(form_471_df, "Form 471")
+
+    return form_471_df
+
+
+def get_form_471_data(
+    form_471_path: pathlib.Path = FORM_471_PATH,
+    columns: list[str] | None = FORM_471_COLUMNS.usecols,
+    dedup: bool = True,
+):
+    """The Form 471s at form_471_path, one per BEN. If dedup, form_471_path is the raw
+    Form 471 basic information, reduced to each BEN's latest Form 471 as it's read;
+    otherwise it's already one per BEN. Either way the parsed frame is cached."""
+    reader = read_raw_form_471_data if dedup else read_form_471_data
+    form_471_df = read_cached(
+        form_471_path,
+        reader=functools.partial(reader, columns=columns),
+        version=hash_parts(SCHEMA_VERSION, FORM_471_SCHEMA, columns, dedup),
+    )
+    return apply_schema(form_471_df, FORM_471_SCHEMA)
+
+
+def _prefetch_input(
+    fetch: Callable[[], pathlib.Path],
+    load: Callable[[pathlib.Path], pd.DataFrame],
+    processes: ProcessPoolExecutor,
+) -> tuple[pd.DataFrame, dict[str, float]]:
+    t0 = time.perf_counter()
+    filepath = fetch()
+
+    t1 = time.perf_counter()
+    df = processes.submit(load, filepath).result()
 
-    for i in ["Urban", "Rural"]:
-        t_ecf_df = ecf_df[ecf_df["Urban/ Rural Status"] == i]
-        t_discount_df = discount_df[discount_df["Rural/Urban"] == i]
+    t2 = time.perf_counter()
+    return df, {"fetch": t1 - t0, "parse": t2 - t1}
 
-        tmp = range_join(
-            left=t_ecf_df,
-            right=t_discount_df,
-            left_on="NSLP Percentage",
-            right_on=(range_col_low, range_col_high),
+
+def prefetch_inputs(
+    ecf_filepath: str | None = None,
+    supp_path: str | None = None,
+    school_districts_path: str | None = None,
+    form_471_path: pathlib.Path = FORM_471_PATH,
+    include_school_districts: bool = True,
+) -> tuple[dict[str, pd.DataFrame | pathlib.Path], dict[str, dict[str, float]]]:
+    """Fetches and parses every input of process_ecf_data concurrently:
+    downloads run on threads, and parsing on a process pool.
+    The wall time thus approaches that of the slowest input, rather than the sum of all of them.
+
+    Returns the parsed frames, and the fetch and parse time of each, by input name.
+    The supplemental data and school districts are instead parsed into their persisted
+    store and index, and returned as the paths process_ecf_data expects."""
+    inputs = {
+        "ecf": (functools.partial(fetch_ecf_data, ecf_filepath), load_ecf_data),
+        "supp": (functools.partial(fetch_supp_data, supp_path), prepare_supp_store),
+        "form_471": (lambda: pathlib.Path(form_471_path), get_form_471_data),
+    }
+    if include_school_districts:
+        inputs["school_districts"] = (
+            functools.partial(fetch_school_districts_data, school_districts_path),
+            prepare_district_index,
         )
-        tmps.append(tmp)
 
-    tmp = pd.concat(tmps).sort_index()
+    t0 = time.perf_counter()
+
+    # The pool's workers start once the download threads are running, so they're
+    # started by a forkserver rather than forked from this multi-threaded process.
+    with ThreadPoolExecutor(max_workers=len(inputs)) as threads, ProcessPoolExecutor(
+        max_workers=len(inputs), mp_context=multiprocessing.get_context("forkserver")
+    ) as processes:
+        futures = {
+            name: threads.submit(_prefetch_input, fetch, load, processes)
+            for name, (fetch, load) in inputs.items()
+        }
+        results = {name: future.result() for name, future in futures.items()}
+
+    frames = {name: df for name, (df, _) in results.items()}
+    timings = {name: timing for name, (_, timing) in results.items()}
+
+    for name, timing in timings.items():
+        print(
+            f"Prefetched {name}: fetch {timing['fetch']:.2f}s, parse {timing['parse']:.2f}s"
+        )
+    print(f"Prefetched all inputs in {time.perf_counter() - t0:.2f}s")
+
+    return frames, timings
+
 
-    assert (tmp.index == ecf_df.index).all()
+def join_state_names(ecf_df: pd.DataFrame) -> pd.DataFrame:
+    check_columns(ecf_df, STATE_NAMES_COLUMNS.needs, stage="join_state_names")
+
+    state_names_df = pd.read_csv(
+        STATE_NAMES_PATH, usecols=STATE_NAMES_COLUMNS.usecols, dtype=STATE_NAMES_SCHEMA
+    )
+
+    ecf_df = merge_n_drop(
+        ecf_df,
+        state_names_df,
+        left_on="Billed Entity State",
+        right_on="Abbreviation",
+        how="left",
+        ensure_m1=False,
+        plan=True,
+    )
 
-    return tmp
+    return ecf_df
 
 
 def join_form_471(
-    ecf_df: pd.DataFrame, ben_col: str = "Billed Entity Number (BEN)"
+    ecf_df: pd.DataFrame,
+    ben_col: str = BEN,
+    form_471_df: pd.DataFrame | None = None,
 ) -> pd.DataFrame:
-    form_471_df = pd.read_csv("data/USA-471s-2018to2022 - Deduped.csv")
+    check_columns(ecf_df, [ben_col], stage="join_form_471")
+
+    if form_471_df is None:
+        form_471_df = get_form_471_data()
 
     ecf_df = merge_n_drop(
         ecf_df,
@@ -213,46 +651,363 @@ def join_form_471(
         right_on="Billed Entity Number",
         how="left",
         ensure_m1=False,
+        plan=True,
     )
 
     return ecf_df
 
 
+def map_supp_data(
+    ecf_df: pd.DataFrame,
+    supp_path: str | None = None,
+    supp_df: pd.DataFrame | None = None,
+) -> pd.DataFrame:
+    """map_bens against the supplemental entities of ecf_df's BENs, unless supp_df is given."""
+    if supp_df is None:
+        supp_df = get_supp_data(supp_path=supp_path, bens=ecf_df[BEN])
+    return map_bens(ecf_df, supp_df=supp_df)
+
+
+def ecf_stages(
+    supp_path: str | None = None,
+    school_districts_path: str | None = None,
+    supp_df: pd.DataFrame | None = None,
+    form_471_df: pd.DataFrame | None = None,
+) -> list[Stage]:
+    """The stages of the ECF pipeline, each with the fingerprints of the lookups it
+    reads, and versioned by the code of PIPELINE_MODULES."""
+    school_districts_path = fetch_school_districts_data(school_districts_path)
+
+    stages = [
+        Stage(
+            "map_bens",
+            functools.partial(map_supp_data, supp_path=supp_path, supp_df=supp_df),
+            inputs=(
+                frame_fingerprint(supp_df)
+                if supp_df is not None
+                else file_fingerprint(build_supp_store(fetch_supp_data(supp_path))),
+            ),
+        ),
+        Stage(
+            "join_school_districts",
+            functools.partial(
+                join_school_districts, school_districts_path=school_districts_path
+            ),
+            inputs=(file_fingerprint(school_districts_path),),
+        ),
+        Stage("dedeup_frns", dedeup_frns),
+        Stage(
+            "join_state_names",
+            join_state_names,
+            inputs=(file_fingerprint(STATE_NAMES_PATH),),
+        ),
+        Stage(
+            "join_form_471",
+            functools.partial(join_form_471, form_471_df=form_471_df),
+            inputs=(
+                frame_fingerprint(form_471_df)
+                if form_471_df is not None
+                else file_fingerprint(FORM_471_PATH),
+            ),
+        ),
+        Stage("join_nslp", join_nslp, inputs=(file_fingerprint(DISCOUNT_MATRIX_PATH),)),
+    ]
+    version = code_version(PIPELINE_MODULES)
+    return [i._replace(version=version) for i in stages]
+
+
 def process_ecf_data(
     ecf_df: pd.DataFrame,
     supp_path: str | None = None,
     school_districts_path: str | None = None,
-    out_filepath: pathlib.Path = OUT_FILEPATH,
+    out_filepath: pathlib.Path | None = OUT_FILEPATH,
+    supp_df: pd.DataFrame | None = None,
+    form_471_df: pd.DataFrame | None = None,
+    checkpoint_dir: pathlib.Path | None = CHECKPOINT_DIR,
+    profile: bool | None = None,
+    out_format: OutputFormat | None = None,
 ):
-    supp_df = get_supp_data(supp_path=supp_path)
-    ecf_df = map_bens(ecf_df, supp_df=supp_df)
+    """Runs the ECF pipeline. Inputs that were already loaded, say by prefetch_inputs,
+    may be passed in as supp_df and form_471_df; otherwise they're fetched here.
+    The output isn't written if out_filepath is None; otherwise it's written in
+    out_format, by default that of out_filepath's suffix (see write_output).
+
+    Each stage's output is checkpointed in checkpoint_dir (unless it's None), so that a
+    rerun only reruns the stages whose code or inputs changed, and those that follow.
+    profile enables a per-stage profile of the run; None defers to PIPELINE_PROFILE."""
+    profiler = Profiler.from_env("process_ecf_data", enabled=profile)
+
+    stages = ecf_stages(
+        supp_path=supp_path,
+        school_districts_path=school_districts_path,
+        supp_df=supp_df,
+        form_471_df=form_471_df,
+    )
+    ecf_df = run_stages(
+        ecf_df,
+        stages,
+        input_key=frame_fingerprint(ecf_df),
+        checkpoint_dir=checkpoint_dir,
+        profiler=profiler,
+    )
 
-    # school_districts_gdf = get_school_districts_data(school_districts_path)
-    # ecf_df = spatial_join(ecf_df, school_districts_gdf=school_districts_gdf)
+    if out_filepath is not None:
+        with profiler.stage("write_output", ecf_df):
+            write_output(ecf_df, out_filepath, format=out_format)
 
-    ecf_df = dedeup_frns(ecf_df)
+    profiler.write_report()
+    return ecf_df
 
-    state_names_df = pd.read_csv("data/us-states-names.csv")
-    ecf_df = merge_n_drop(
-        ecf_df,
-        state_names_df,
-        left_on="Billed Entity State",
-        right_on="Abbreviation",
-        how="left",
-        ensure_m1=False,
+
+def _process_shard(
+    shard_df: pd.DataFrame,
+    supp_df: pd.DataFrame,
+    form_471_df: pd.DataFrame,
+    school_districts_path: pathlib.Path,
+) -> pd.DataFrame:
+    return process_ecf_data(
+        shard_df,
+        school_districts_path=school_districts_path,
+        out_filepath=None,
+        supp_df=supp_df,
+        form_471_df=form_471_df,
+        checkpoint_dir=None,
+        profile=False,
     )
 
-    ecf_df = join_form_471(ecf_df)
 
-    ecf_df = join_nslp(ecf_df)
+def _pack(sizes: pd.Series, n_bins: int) -> pd.Series:
+    """Assigns each item, largest first, to the bin holding the fewest rows so far."""
+    sizes = sizes.rename_axis("key").reset_index(name="size")
+    sizes = sizes.sort_values(["size", "key"], ascending=[False, True])
+
+    loads = np.zeros(n_bins, dtype=int)
+    bins = []
+    for size in sizes["size"]:
+        bins.append(i := int(loads.argmin()))
+        loads[i] += size
+
+    return pd.Series(bins, index=sizes["key"].to_numpy())
+
+
+def shard_keys(
+    ecf_df: pd.DataFrame, shard_by: Literal["state", "frn"], n_shards: int
+) -> pd.Series:
+    """The shard (0 to n_shards - 1) of each row of ecf_df; every row of an FRN shares one.
+
+    By state, each FRN goes by the state of its first row (each FRN belongs to a single
+    state), and whole states are packed into shards of about the same number of rows.
+    By FRN, the FRN's hash decides."""
+    frns = ecf_df["Funding Request Number (FRN)"]
+
+    if shard_by == "state":
+        states = (
+            ecf_df["Billed Entity State"]
+            .astype(object)
+            .groupby(frns, dropna=False)
+            .transform("first")
+            .fillna("")
+        )
+        return states.map(_pack(states.value_counts(), n_bins=n_shards))
+    if shard_by == "frn":
+        hashes = pd.util.hash_array(frns.to_numpy(dtype=object))
+        return pd.Series(hashes % n_shards, index=ecf_df.index)
+
+    raise ValueError(f"Unsupported shard key: {shard_by}")
+
+
+def process_ecf_data_sharded(
+    ecf_df: pd.DataFrame,
+    supp_path: str | None = None,
+    school_districts_path: str | None = None,
+    out_filepath: pathlib.Path | None = OUT_FILEPATH,
+    supp_df: pd.DataFrame | None = None,
+    form_471_df: pd.DataFrame | None = None,
+    processes: int | None = None,
+    shard_by: Literal["state", "frn"] = "state",
+    out_format: OutputFormat | None = None,
+):
+    """Sharded version of process_ecf_data, with the same output.
+
+    The ECF frame is split by "Billed Entity State" (or FRN hash), keeping FRNs whole,
+    and each shard is run through the pipeline on a process pool. Each worker is sent its
+    shard's slice of the supplemental and 471 data; the other lookups are small and
+    read by each. The school districts of every BEN are located here beforehand,
+    so that the workers only read the persisted lookup (see spatial_join).
+    The shards' outputs are put back in the order of the rows they came from."""
+    school_districts_path = fetch_school_districts_data(school_districts_path)
+    if supp_df is None:
+        supp_df = get_supp_data(supp_path=supp_path, bens=ecf_df[BEN])
+    if form_471_df is None:
+        form_471_df = get_form_471_data()
+
+    join_school_districts(
+        map_bens(ecf_df[[BEN]].drop_duplicates(), supp_df=supp_df),
+        school_districts_path=school_districts_path,
+    )
+
+    n_shards = processes or os.cpu_count() or 1
+    ecf_df = ecf_df.assign(**{ROW_COL: np.arange(len(ecf_df))})
+    keys = shard_keys(ecf_df, shard_by=shard_by, n_shards=n_shards)
+
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = []
+        for _, shard_df in ecf_df.groupby(keys, sort=True):
+            bens = shard_df[BEN]
+            futures.append(
+                pool.submit(
+                    _process_shard,
+                    shard_df,
+                    supp_df=supp_df[supp_df["Entity Number"].isin(bens)],
+                    form_471_df=form_471_df[
+                        form_471_df["Billed Entity Number"].isin(bens)
+                    ],
+                    school_districts_path=school_districts_path,
+                )
+            )
+        shard_dfs = [future.result() for future in futures]
+
+    ecf_df = (
+        concat_frames(shard_dfs)
+        .sort_values(ROW_COL, kind="stable")
+        .drop(columns=ROW_COL)
+        .reset_index(drop=True)
+    )
 
-    ecf_df.to_csv(out_filepath, index=False)
+    if out_filepath is not None:
+        write_output(ecf_df, out_filepath, format=out_format)
     return ecf_df
 
 
+def frn_group_signatures(ecf_df: pd.DataFrame) -> pd.DataFrame:
+    """One row per FRN group: its number of rows, and the sum of its rows' hashes
+    (every column, PK included), which is independent of row order."""
+    # The top 32 bits of each hash, so the sums can't overflow.
+    row_hashes = pd.Series(
+        (pd.util.hash_pandas_object(ecf_df, index=False).to_numpy() >> 32).astype(
+            "int64"
+        ),
+        index=ecf_df.index,
+    )
+    return (
+        row_hashes.groupby([ecf_df[i] for i in FRN_GROUP], dropna=False)
+        .agg(["count", "sum"])
+        .reset_index()
+    )
+
+
+def changed_frn_groups(
+    prev_signatures: pd.DataFrame, signatures: pd.DataFrame
+) -> pd.MultiIndex:
+    """FRN groups that were added, removed, or whose rows changed between two pulls."""
+    diff = pd.merge(
+        prev_signatures, signatures, on=FRN_GROUP, how="outer", indicator=True
+    )
+    changed = (
+        (diff["_merge"] != "both")
+        | (diff["count_x"] != diff["count_y"])
+        | (diff["sum_x"] != diff["sum_y"])
+    )
+    return pd.MultiIndex.from_frame(diff.loc[changed, FRN_GROUP])
+
+
+def process_ecf_data_incremental(
+    ecf_df: pd.DataFrame,
+    supp_path: str | None = None,
+    school_districts_path: str | None = None,
+    out_filepath: pathlib.Path = OUT_FILEPATH,
+    supp_df: pd.DataFrame | None = None,
+    form_471_df: pd.DataFrame | None = None,
+    snapshot_dir: pathlib.Path = SNAPSHOT_DIR,
+    out_format: OutputFormat | None = None,
+):
+    """Incremental version of process_ecf_data. The pull is diffed against the previous
+    one, saved in snapshot_dir, by FRN group; only the groups that were added or changed
+    are processed, and merged into the previously materialized output, from which the
+    changed and removed groups are dropped.
+
+    The output is recomputed in full if there's no snapshot, or if any lookup table
+    (supplemental, 471, school districts, state names or discount matrix), the code
+    of any stage, or SCHEMA_VERSION changed since it was taken.
+    Reprocessed groups are appended after the unchanged ones."""
+    if form_471_df is None:
+        form_471_df = get_form_471_data()
+
+    # The checkpoint key of the last stage covers every stage's lookups and code.
+    stages = ecf_stages(
+        supp_path=supp_path,
+        school_districts_path=school_districts_path,
+        supp_df=supp_df,
+        form_471_df=form_471_df,
+    )
+    lookups_version = stage_keys(stages, input_key=hash_parts(SCHEMA_VERSION))[-1]
+
+    snapshot_dir = pathlib.Path(snapshot_dir)
+    signatures_path = snapshot_dir / "signatures.parquet"
+    output_path = snapshot_dir / "output.parquet"
+    meta_path = snapshot_dir / "meta.json"
+
+    signatures = frn_group_signatures(ecf_df)
+
+    if (
+        meta_path.exists()
+        and json.loads(meta_path.read_text()).get("lookups") == lookups_version
+    ):
+        changed = changed_frn_groups(pd.read_parquet(signatures_path), signatures)
+        print(f"Reprocessing {len(changed)} changed FRN groups")
+
+        prev_out_df = pd.read_parquet(output_path)
+        prev_out_df = prev_out_df[
+            ~pd.MultiIndex.from_frame(prev_out_df[FRN_GROUP]).isin(changed)
+        ]
+
+        changed_ecf_df = ecf_df[
+            pd.MultiIndex.from_frame(ecf_df[FRN_GROUP]).isin(changed)
+        ]
+        out_df = process_ecf_data(
+            changed_ecf_df,
+            supp_path=supp_path,
+            school_districts_path=school_districts_path,
+            out_filepath=None,
+            supp_df=supp_df,
+            form_471_df=form_471_df,
+            # Checkpoints of a subset would evict those of the last full run.
+            checkpoint_dir=None,
+        )
+
+        out_df = pd.concat([prev_out_df, out_df], ignore_index=True)
+        write_output(out_df, out_filepath, format=out_format)
+    else:
+        print("No usable snapshot; processing all FRN groups")
+        out_df = process_ecf_data(
+            ecf_df,
+            supp_path=supp_path,
+            school_districts_path=school_districts_path,
+            out_filepath=out_filepath,
+            supp_df=supp_df,
+            form_471_df=form_471_df,
+            out_format=out_format,
+        )
+
+    snapshot_dir.mkdir(parents=True, exist_ok=True)
+    signatures.to_parquet(signatures_path, index=False)
+    out_df.to_parquet(output_path, index=False)
+    meta_path.write_text(json.dumps({"lookups": lookups_version}))
+
+    return out_df
+
+
 if __name__ == "__main__":
     out_filepath = OUT_FILEPATH
-    ecf_df = get_ecf_data()
-    ecf_df = process_ecf_data(ecf_df=ecf_df, out_filepath=out_filepath)
+    frames, _ = prefetch_inputs()
+    ecf_df = process_ecf_data_incremental(
+        ecf_df=frames["ecf"],
+        supp_path=frames["supp"],
+        school_districts_path=frames["school_districts"],
+        out_filepath=out_filepath,
+        form_471_df=frames["form_471"],
+    )
+
+    consulting_firms_table(ecf_df).to_csv(FIRMS_FILEPATH, index=False)
 
-    upload_sheet(filepath=out_filepath)
+    upload_sheet([out_filepath, FIRMS_FILEPATH])
@@ -2,18 +2,55 @@ import pathlib
 
 import pandas as pd
 
+from src.schemas import FORM_471_SCHEMA
+from src.utils import CHUNKSIZE
+
 BEN = "Billed Entity Number"
 FUNDING_YEAR = "Funding Year"
 CAT1_DISCOUNT = "Category One Discount Rate"
 
-path = pathlib.Path("data/E-Rate_Request_for_Discount_on_Services__Basic_Information__FCC_Form_471_and_Related_Information__20231023.csv")
+RAW_PATH = pathlib.Path(
+    "data/E-Rate_Request_for_Discount_on_Services__Basic_Information__FCC_Form_471_and_Related_Information__20231023.csv"
+)
 
-app_df = pd.read_csv(path)
+KEY = [BEN, FUNDING_YEAR, CAT1_DISCOUNT]
 
-key = [BEN, FUNDING_YEAR, CAT1_DISCOUNT]
 
-bens = app_df.sort_values(key, ascending=[True, False, False]).drop_duplicates(
-    BEN, keep="first"
-)
+def top_per_ben(df: pd.DataFrame) -> pd.DataFrame:
+    """Each BEN's row of the latest funding year, and of those the highest discount
+    rate; of rows tied on both, the first."""
+    return df.sort_values(
+        KEY, ascending=[True, False, False], kind="stable"
+    ).drop_duplicates(BEN, keep="first")
+
+
+def dedup_form_471(
+    path: pathlib.Path = RAW_PATH,
+    usecols: list[str] | None = None,
+    chunksize: int = CHUNKSIZE,
+) -> pd.DataFrame:
+    """top_per_ben of the Form 471s at path, read chunksize rows at a time.
+
+    Only the best row of each BEN seen so far is kept between chunks, so memory is
+    bounded by the number of distinct BENs rather than by the size of the file."""
+    if usecols is not None:
+        usecols = list(dict.fromkeys(KEY + usecols))
+
+    best = None
+    with pd.read_csv(
+        path, dtype=FORM_471_SCHEMA, usecols=usecols, chunksize=chunksize
+    ) as reader:
+        for chunk in reader:
+            # The kept rows come first, so they win ties with later rows as they would
+            # in a single pass over the whole file.
+            best = top_per_ben(chunk if best is None else pd.concat([best, chunk]))
+
+    if best is None:
+        return pd.read_csv(path, dtype=FORM_471_SCHEMA, usecols=usecols, nrows=0)
+
+    return best.reset_index(drop=True)
+
 
-bens.to_csv(path.with_stem(f"{path.stem} - Deduped"), index=False)
+if __name__ == "__main__":
+    bens = dedup_form_471(RAW_PATH)
+    bens.to_csv(RAW_PATH.with_stem(f"{RAW_PATH.stem} - Deduped"), index=False)
@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import functools
+import importlib
+import inspect
+import pathlib
+from typing import Callable, NamedTuple
+
+import pandas as pd
+
+from src.profiling import Profiler
+from src.utils import hash_parts, write_cache
+
+
+class Stage(NamedTuple):
+    """A named step of a pipeline, taking the previous stage's frame to its own.
+
+    inputs identifies whatever else the stage reads (say the fingerprints of its lookup
+    files). The stage's code is identified by the source of fn, and version; as only fn's
+    own source is hashed, version should cover what fn calls, e.g. as the code_version
+    of the modules it's defined in."""
+
+    name: str
+    fn: Callable[[pd.DataFrame], pd.DataFrame]
+    inputs: tuple = ()
+    version: int | str = 1
+
+
+def code_version(modules: list[str]) -> str:
+    """Hash of the source of the named modules."""
+    return hash_parts(*(inspect.getsource(importlib.import_module(i)) for i in modules))
+
+
+def _source(fn: Callable) -> str:
+    while isinstance(fn, functools.partial):
+        fn = fn.func
+    try:
+        return inspect.getsource(fn)
+    except (OSError, TypeError):
+        return getattr(fn, "__qualname__", repr(fn))
+
+
+def stage_keys(stages: list[Stage], input_key: str) -> list[str]:
+    """The checkpoint key of each stage's output: a hash of the key of its input
+    (input_key for the first stage), its inputs, and its code."""
+    keys = []
+    for stage in stages:
+        input_key = hash_parts(
+            input_key, stage.name, stage.inputs, stage.version, _source(stage.fn)
+        )
+        keys.append(input_key)
+    return keys
+
+
+def checkpoint_path(checkpoint_dir: pathlib.Path, name: str, key: str) -> pathlib.Path:
+    return checkpoint_dir / f"{name}.{key}.parquet"
+
+
+def _run_stage(
+    stage: Stage, df: pd.DataFrame, profiler: Profiler | None
+) -> pd.DataFrame:
+    if profiler is None:
+        return stage.fn(df)
+
+    with profiler.stage(stage.name, df) as result:
+        result["out"] = stage.fn(df)
+    return result["out"]
+
+
+def run_stages(
+    df: pd.DataFrame,
+    stages: list[Stage],
+    input_key: str,
+    checkpoint_dir: pathlib.Path | None = None,
+    profiler: Profiler | None = None,
+) -> pd.DataFrame:
+    """Runs df through stages in order.
+
+    If checkpoint_dir is given, each stage's output is checkpointed there as Parquet,
+    keyed as in stage_keys, and a rerun resumes from the last stage whose checkpoint
+    is still valid: a change to a stage's code or inputs only reruns it and what follows.
+    input_key should identify df, e.g. its frame_fingerprint.
+    Stages that are run, rather than resumed past, are recorded by profiler."""
+    if checkpoint_dir is None:
+        for stage in stages:
+            df = _run_stage(stage, df, profiler)
+        return df
+
+    checkpoint_dir = pathlib.Path(checkpoint_dir)
+    checkpoint_dir.mkdir(parents=True, exist_ok=True)
+
+    keys = stage_keys(stages, input_key)
+
+    start = 0
+    for i in reversed(range(len(stages))):
+        path = checkpoint_path(checkpoint_dir, stages[i].name, keys[i])
+        if path.exists():
+            print(f"Resuming after stage {stages[i].name}")
+            df = pd.read_parquet(path)
+            start = i + 1
+            break
+
+    for stage, key in zip(stages[start:], keys[start:]):
+        df = _run_stage(stage, df, profiler)
+        write_cache(
+            df,
+            checkpoint_dir / stage.name,
+            checkpoint_path(checkpoint_dir, stage.name, key),
+        )
+
+    return df
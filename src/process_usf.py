@@ -1,9 +1,30 @@
 import pathlib
+from concurrent.futures import ProcessPoolExecutor
 from typing import Any
 
+import numpy as np
+import openpyxl
 import pandas as pd
 from googleapiutils2 import Sheets, get_oauth2_creds
 
+from src.profiling import Profiler
+from src.schemas import (
+    ACP_SCHEMA,
+    ECF_SCHEMA,
+    STATE_NAMES_SCHEMA,
+    USF_SCHEMA,
+    apply_schema,
+    report_memory,
+)
+from src.sheets_sync import sync_frame
+from src.utils import (
+    cache_filepath,
+    file_digest,
+    hash_parts,
+    read_output,
+    write_cache,
+)
+
 SHEET_URL = "https://docs.google.com/spreadsheets/d/1F8GNe4VwSc8kuFE0mdGGtZfiFpLcMG26LNUTlkOHTH8/edit#gid=0"
 
 HEADER = [
@@ -41,6 +62,12 @@ TABLE = "1.9"
 
 YEARS_IN_THOUSANDS = [2022, 2021, 2018, 2017, 2016, 2015]
 
+# Cell values pd.read_excel reads as missing.
+NA_STRINGS = ["", "#N/A", "N/A", "NA", "n/a", "#NA", "NULL", "null", "NaN", "nan"]
+
+# Bump whenever the way workbooks are parsed changes, to invalidate their cached tables.
+PARSE_VERSION = 1
+
 
 def dollar_to_float(value: Any) -> float:
     try:
@@ -50,93 +77,158 @@ def dollar_to_float(value: Any) -> float:
 
 
 def find_first(df: pd.DataFrame, value: str) -> int | None:
-    for ix, row in df.iterrows():
-        if any(value.lower() in str(cell).lower() for cell in row):
-            return ix
-    return None
+    """Index of the first row with a cell containing value, case-insensitively."""
+    cells = np.char.lower(df.to_numpy(dtype=str))
+    rows = np.flatnonzero((np.char.find(cells, value.lower()) >= 0).any(axis=1))
+    return df.index[rows[0]] if len(rows) else None
 
 
-def process_dir(dir_path: pathlib.Path):
-    dfs = []
+def read_table(file: pathlib.Path) -> pd.DataFrame | None:
+    """The raw rows of file's TABLE sheet, or None if it has none. The workbook is
+    opened once, read-only, streaming only that sheet's cell values."""
+    workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+    try:
+        sheet_name = next((i for i in workbook.sheetnames if TABLE in i), None)
+        if sheet_name is None:
+            print(f"Could not find sheet {TABLE} in {file.name}")
+            return None
 
-    for file in dir_path.glob("**/*.xlsx"):
-        if "Section 1" not in file.name or "~$" in file.name:
-            continue
-        year = int(file.parent.name)
+        df = pd.DataFrame(list(workbook[sheet_name].iter_rows(values_only=True)))
+    finally:
+        workbook.close()
 
-        print(f"Processing {file}")
+    # read missing values as pd.read_excel does:
+    return df.replace(NA_STRINGS, np.nan)
 
-        sheet_name = None
-        for t_sheet_name in pd.ExcelFile(file).sheet_names:
-            if TABLE in t_sheet_name:
-                sheet_name = t_sheet_name
-                break
-        else:
-            print(f"Could not find sheet {TABLE} in {file.name}")
-            continue
 
-        df = pd.read_excel(file, sheet_name=sheet_name, header=None)
+def parse_sheet(df: pd.DataFrame, year: int) -> pd.DataFrame:
+    """Parses the raw rows of a year's table into one row per state."""
+    # remove normalize header:
+    header_ix = find_first(df, HEADER_MARKER)
+    df = df.iloc[header_ix + 1 :].reset_index(drop=True)
+
+    # remove empty bottom rows after total:
+    total_ix = find_first(df, "Total")
+    df = df.iloc[:total_ix].reset_index(drop=True)
 
-        # remove empty rows:
-        df = df.replace(r"^\s*$", pd.NA, regex=True)
+    # remove empty rows, of the table alone:
+    df = df.replace(r"^\s*$", pd.NA, regex=True)
+    df = df.dropna(axis=1, how="all")
 
-        # remove normalize header:
-        header_ix = find_first(df, HEADER_MARKER)
-        df = df.iloc[header_ix + 1 :].reset_index(drop=True)
+    df = df.iloc[:, : len(HEADER)]
+    df.columns = HEADER
 
-        # remove empty bottom rows after total:
-        total_ix = find_first(df, "Total")
-        df = df.iloc[:total_ix].reset_index(drop=True)
-        df = df.dropna(axis=1, how="all")
+    df[DOLLAR_HEADER] = df[DOLLAR_HEADER].astype(float)
 
-        df = df.iloc[:, : len(HEADER)]
-        df.columns = HEADER
+    if year in YEARS_IN_THOUSANDS:
+        df[DOLLAR_HEADER] *= 1000.0
+        if year == 2017:
+            df[["High Cost", "Low Income"]] /= 1000.0
+        if year == 2018:
+            df["Schools & Libraries"] /= 1000.0
 
-        df[DOLLAR_HEADER] = df[DOLLAR_HEADER].astype(float)
+    df["Year"] = year
+    df["State Import"] = df["Delta"] / df["Contributions"]
 
-        if year in YEARS_IN_THOUSANDS:
-            df[DOLLAR_HEADER] *= 1000.0
-            if year == 2017:
-                df[["High Cost", "Low Income"]] /= 1000.0
-            if year == 2018:
-                df["Schools & Libraries"] /= 1000.0
+    df["Total Subsidies"] = df[SUBSIDIES_HEADER].sum(axis=1)
 
-        df["Year"] = year
-        df["State Import"] = df["Delta"] / df["Contributions"]
+    df["% of Total Subsidies"] = df["Total Subsidies"] / df["Total Subsidies"].sum()
 
-        df["Total Subsidies"] = df[SUBSIDIES_HEADER].sum(axis=1)
+    df["% of Total Contributions"] = df["Contributions"] / df["Contributions"].sum()
 
-        df["% of Total Subsidies"] = df["Total Subsidies"] / df["Total Subsidies"].sum()
+    df["Delta"] = df["Total Subsidies"] - df["Contributions"]
 
-        df["% of Total Contributions"] = df["Contributions"] / df["Contributions"].sum()
+    df["State Import"] = df["Delta"] / df["Contributions"]
+    df["Net Retention"] = 1 + df["State Import"]
 
-        df["Delta"] = df["Total Subsidies"] - df["Contributions"]
+    # sort df by state:
+    df = df.sort_values(["State"], ascending=[True]).reset_index(drop=True)
 
-        df["State Import"] = df["Delta"] / df["Contributions"]
-        df["Net Retention"] = 1 + df["State Import"]
+    # verify the first state is Alabama, and the last state is Wyoming:
+    assert df["State"].iloc[0] == "Alabama"
+    assert df["State"].iloc[-1] == "Wyoming"
+
+    return df
 
-        # sort df by state:
-        df = df.sort_values(["State"], ascending=[True]).reset_index(drop=True)
 
-        # verify the first state is Alabama, and the last state is Wyoming:
-        assert df["State"].iloc[0] == "Alabama"
-        assert df["State"].iloc[-1] == "Wyoming"
+def table_cache_path(file: pathlib.Path) -> pathlib.Path:
+    """Path of the cache of file's parsed table, keyed by the hash of its contents."""
+    version = hash_parts(PARSE_VERSION, TABLE, HEADER, YEARS_IN_THOUSANDS)
+    return cache_filepath(file, version=version, fingerprint=file_digest)
 
-        dfs.append(df)
 
-    df = pd.concat(dfs).reset_index(drop=True)
-    df = df.sort_values(["Year"], ascending=[False]).reset_index(drop=True)
+def parse_workbook(file: pathlib.Path, cache_path: pathlib.Path) -> pd.DataFrame | None:
+    """Parses file's table and caches it at cache_path; None if it has no table."""
+    df = read_table(file)
+    if df is None:
+        return None
+
+    df = parse_sheet(df, year=int(file.parent.name))
+    write_cache(df, file, cache_path)
+
+    return df
+
+
+def process_dir(
+    dir_path: pathlib.Path,
+    profile: bool | None = None,
+    processes: int | None = None,
+):
+    """Parses the table of every year's workbook under dir_path.
+
+    Each workbook's parsed table is cached next to it, so a rerun only parses the
+    workbooks that are new or changed, on a pool of up to processes processes.
+    profile enables a per-stage profile of the run; None defers to PIPELINE_PROFILE."""
+    profiler = Profiler.from_env("process_usf", enabled=profile)
+
+    files = [
+        i
+        for i in dir_path.glob("**/*.xlsx")
+        if "Section 1" in i.name and "~$" not in i.name
+    ]
+
+    with profiler.stage("read_cached") as result:
+        cache_paths = {i: table_cache_path(i) for i in files}
+        dfs = {
+            i: pd.read_parquet(cache_paths[i]) for i in files if cache_paths[i].exists()
+        }
+
+    misses = [i for i in files if i not in dfs]
+
+    with profiler.stage("parse") as result:
+        if misses:
+            with ProcessPoolExecutor(max_workers=processes) as pool:
+                parsed = pool.map(
+                    parse_workbook, misses, [cache_paths[i] for i in misses]
+                )
+                for file, df in zip(misses, parsed):
+                    print(f"Processed {file}")
+                    dfs[file] = df
+
+    with profiler.stage("concat") as result:
+        df = pd.concat([dfs[i] for i in files if dfs[i] is not None])
+        df = df.reset_index(drop=True)
+        df = df.sort_values(["Year"], ascending=[False]).reset_index(drop=True)
+
+        df = result["out"] = apply_schema(df, USF_SCHEMA)
+
+    report_memory(df, "USF")
+    profiler.write_report()
 
     return df
 
 
 def join_ecf(usf_df: pd.DataFrame, ecf_filepath: pathlib.Path):
-    ecf_df = pd.read_csv(ecf_filepath)
+    ecf_df = read_output(
+        ecf_filepath,
+        usecols=["Funding Request Status", "Billed Entity State", "Line Total Cost"],
+        dtype=ECF_SCHEMA,
+    )
 
     ecf_df = ecf_df[ecf_df["Funding Request Status"] == "Funded"]
 
     ecf_df = (
-        ecf_df.groupby(["Billed Entity State"])
+        ecf_df.groupby(["Billed Entity State"], observed=True)
         .agg({"Line Total Cost": "sum"})
         .reset_index()
     )
@@ -154,7 +246,8 @@ def join_ecf(usf_df: pd.DataFrame, ecf_filepath: pathlib.Path):
 
 
 def join_acp(usf_df: pd.DataFrame, acp_filepath: pathlib.Path):
-    acp_df = pd.read_csv(acp_filepath)
+    acp_df = read_output(acp_filepath, dtype=ACP_SCHEMA)
+    report_memory(acp_df, "ACP")
 
     # agg the acp_df by Data Month, which is Month-Year, by year, and then by State
     acp_df["Data Month"] = pd.to_datetime(acp_df["Data Month"], format="%b-%y")
@@ -162,7 +255,9 @@ def join_acp(usf_df: pd.DataFrame, acp_filepath: pathlib.Path):
 
     acp_df[" Total Support "] = acp_df[" Total Support "].apply(dollar_to_float)
     acp_df = (
-        acp_df.groupby(["Year", "State"]).agg({" Total Support ": "sum"}).reset_index()
+        acp_df.groupby(["Year", "State"], observed=True)
+        .agg({" Total Support ": "sum"})
+        .reset_index()
     )
 
     # merge the acp_df with the usf_df on Year and State (which is an abbreviation)
@@ -181,7 +276,7 @@ def join_acp(usf_df: pd.DataFrame, acp_filepath: pathlib.Path):
 
 def join_state_names(usf_df: pd.DataFrame, us_states_names_path: pathlib.Path):
 
-    us_states_names_df = pd.read_csv(us_states_names_path)
+    us_states_names_df = read_output(us_states_names_path, dtype=STATE_NAMES_SCHEMA)
     us_states_names_df = us_states_names_df.rename(
         columns={"Name": "State Name", "Abbreviation": "State Abbreviation"}
     )
@@ -208,8 +303,5 @@ if __name__ == "__main__":
     )
     df = join_acp(usf_df=df, acp_filepath=acp_filepath)
 
-    sheets.clear(spreadsheet_id=SHEET_URL, range_name="Sheet1")
-    sheets.update(
-        spreadsheet_id=SHEET_URL, range_name="Sheet1", values=sheets.from_frame(df)
-    )
+    sync_frame(sheets, spreadsheet_id=SHEET_URL, sheet_name="Sheet1", df=df)
     sheets.resize_columns(spreadsheet_id=SHEET_URL, sheet_name="Sheet1", width=120)
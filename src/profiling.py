@@ -0,0 +1,175 @@
+"""Per-stage wall and CPU time, memory and frame shapes of a pipeline run.
+
+Profiling is enabled by a function's profile flag or, failing that, by the
+PIPELINE_PROFILE environment variable; the report of each run is written as JSON
+to PROFILE_DIR, timestamped, so that runs can be compared over time.
+PIPELINE_CPROFILE names the stages (comma-separated, or "*" for all) to also run
+under cProfile, whose stats are dumped next to the report."""
+
+from __future__ import annotations
+
+import contextlib
+import cProfile
+import datetime
+import json
+import os
+import pathlib
+import resource
+import time
+import tracemalloc
+
+import pandas as pd
+
+PROFILE_ENV = "PIPELINE_PROFILE"
+CPROFILE_ENV = "PIPELINE_CPROFILE"
+
+PROFILE_DIR = pathlib.Path("data/profiles")
+
+
+def _frame_stats(df: pd.DataFrame | None, prefix: str) -> dict:
+    if not isinstance(df, pd.DataFrame):
+        return {}
+    return {
+        f"{prefix}_rows": len(df),
+        f"{prefix}_columns": len(df.columns),
+        f"{prefix}_bytes": int(df.memory_usage(deep=True).sum()),
+    }
+
+
+def _reset_peak_rss() -> bool:
+    """Resets the process's peak RSS (VmHWM) to its current RSS, where Linux allows it.
+    Returns whether it did."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return False
+    return True
+
+
+def _peak_rss_bytes() -> int:
+    """The process's peak RSS since it was last reset, or failing that since it started."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is in KiB on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _children_usage() -> tuple[float, int]:
+    """The CPU time of the exited child processes, and the largest of their peak RSS."""
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime, usage.ru_maxrss * 1024
+
+
+class Profiler:
+    """Records the metrics of each stage run within stage(). A disabled profiler
+    records nothing and costs nothing."""
+
+    def __init__(
+        self,
+        run: str,
+        enabled: bool = False,
+        cprofile_stages: list[str] | None = None,
+        profile_dir: pathlib.Path = PROFILE_DIR,
+    ):
+        self.run = run
+        self.enabled = enabled
+        self.cprofile_stages = cprofile_stages or []
+        self.profile_dir = pathlib.Path(profile_dir)
+        self.started = datetime.datetime.now().strftime("%Y%m%dT%H%M%S")
+        self.stages: list[dict] = []
+
+    @classmethod
+    def from_env(cls, run: str, enabled: bool | None = None) -> Profiler:
+        """A profiler enabled by enabled, or if it's None, by PROFILE_ENV."""
+        if enabled is None:
+            enabled = os.environ.get(PROFILE_ENV, "").lower() not in ("", "0", "false")
+
+        cprofile_stages = [
+            i.strip() for i in os.environ.get(CPROFILE_ENV, "").split(",") if i.strip()
+        ]
+        return cls(run, enabled=enabled, cprofile_stages=cprofile_stages)
+
+    def _cprofiled(self, name: str) -> bool:
+        return "*" in self.cprofile_stages or name in self.cprofile_stages
+
+    @contextlib.contextmanager
+    def stage(self, name: str, df: pd.DataFrame | None = None):
+        """Profiles the body as the stage name, whose input frame is df.
+        Yields a dict; set its "out" to the stage's output frame to record its shape.
+
+        peak_rss_bytes is the stage's own peak where the peak can be reset (Linux),
+        and otherwise the process's. The CPU time and peak RSS of child processes, say
+        of a pool, are counted apart once they've exited (the latter being the largest
+        of any child so far); tracemalloc doesn't see their memory."""
+        result = {}
+        if not self.enabled:
+            yield result
+            return
+
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+
+        profile = cProfile.Profile() if self._cprofiled(name) else None
+
+        stage_peak = _reset_peak_rss()
+
+        wall, cpu = time.perf_counter(), time.process_time()
+        children_cpu, _ = _children_usage()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield result
+        finally:
+            if profile is not None:
+                profile.disable()
+
+            children_cpu_end, children_peak_rss = _children_usage()
+            metrics = {
+                "stage": name,
+                "wall_s": time.perf_counter() - wall,
+                "cpu_s": time.process_time() - cpu,
+                "children_cpu_s": children_cpu_end - children_cpu,
+                "children_peak_rss_bytes": children_peak_rss,
+                "tracemalloc_peak_bytes": tracemalloc.get_traced_memory()[1],
+                "peak_rss_bytes": _peak_rss_bytes(),
+                "peak_rss_scope": "stage" if stage_peak else "process",
+                **_frame_stats(df, "in"),
+                **_frame_stats(result.get("out"), "out"),
+            }
+            if not tracing:
+                tracemalloc.stop()
+
+            if profile is not None:
+                self.profile_dir.mkdir(parents=True, exist_ok=True)
+                stats_path = self.profile_dir / (
+                    f"{self.run}-{self.started}-{name.replace('/', '_')}.prof"
+                )
+                profile.dump_stats(stats_path)
+                metrics["cprofile"] = str(stats_path)
+
+            self.stages.append(metrics)
+
+    def write_report(self) -> pathlib.Path | None:
+        """Writes the recorded stages as JSON, returning the report's path."""
+        if not self.enabled:
+            return None
+
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        report_path = self.profile_dir / f"{self.run}-{self.started}.json"
+        report_path.write_text(
+            json.dumps(
+                {"run": self.run, "started": self.started, "stages": self.stages},
+                indent=2,
+            )
+        )
+        print(f"Wrote profile of {self.run} to {report_path}")
+
+        return report_path
@@ -0,0 +1,99 @@
+"""Declared dtypes for the columns of each source dataset we read.
+
+Low-cardinality strings (statuses, states, types) are categoricals, IDs are
+nullable integers of the narrowest width that holds them, and free text is
+Arrow-backed. Columns not listed here are left to pandas' dtype inference.
+Bump SCHEMA_VERSION whenever the way a dataset is parsed changes, to invalidate
+any cached copies parsed the old way."""
+
+from __future__ import annotations
+
+import pandas as pd
+
+SCHEMA_VERSION = 2
+
+TEXT = "string[pyarrow]"
+
+ECF_SCHEMA = {
+    "Funding Request Number (FRN)": "string",
+    "FRN Line Item ID": "string",
+    "Funding Request Status": "category",
+    "Billed Entity Number (BEN)": "Int32",
+    "Billed Entity State": "category",
+    "Urban/ Rural Status": "category",
+    "Consulting Firm": TEXT,
+    "NSLP Percentage": "float64",
+    "Line Total Cost": "float64",
+}
+
+SUPP_SCHEMA = {
+    "Entity Number": "Int32",
+    "Parent Entity Number": "Int32",
+    "Entity Name": TEXT,
+    "Entity Type": "category",
+    "Parent Entity Name": TEXT,
+    "Physical County": "category",
+    "Urban/ Rural Status": "category",
+    "Latitude": "float64",
+    "Longitude": "float64",
+    "Total Number of Full-Time Students": "float64",
+    "Total Number of Part-Time Students": "float64",
+    "Peak Number of Part-Time Students": "float64",
+    "Number of NSLP Students": "float64",
+}
+
+FORM_471_SCHEMA = {
+    "Billed Entity Number": "Int32",
+    "Funding Year": "Int16",
+    "Category One Discount Rate": "float64",
+}
+
+USF_SCHEMA = {
+    "State": "category",
+    "State Abbreviation": "category",
+    "Year": "Int16",
+}
+
+ACP_SCHEMA = {
+    "Data Month": "category",
+    "State": "category",
+    "State Name": "category",
+    "County Name": "category",
+    "State FIPS": "Int8",
+    "County FIPS": "Int32",
+}
+
+STATE_NAMES_SCHEMA = {"Name": "category", "Abbreviation": "category"}
+
+DISCOUNT_MATRIX_SCHEMA = {"Rural/Urban": "category"}
+
+
+def apply_schema(df: pd.DataFrame, schema: dict[str, str]) -> pd.DataFrame:
+    """Casts each of df's columns that schema declares to its declared dtype, if it
+    isn't already; e.g. Parquet reads Arrow-backed strings back as Python-backed ones."""
+    return df.astype(
+        {k: v for k, v in schema.items() if k in df.columns and df[k].dtype != v}
+    )
+
+
+def _inferred_nbytes(s: pd.Series) -> int:
+    """Bytes s would take as pandas infers it: object for strings, float64 for
+    integers with NaNs."""
+    if isinstance(s.dtype, (pd.CategoricalDtype, pd.StringDtype)):
+        return s.astype(object).memory_usage(deep=True, index=False)
+    if pd.api.types.is_integer_dtype(s.dtype):
+        return len(s) * 8
+    return s.memory_usage(deep=True, index=False)
+
+
+def report_memory(df: pd.DataFrame, dataset: str):
+    """Prints the memory df takes under its declared dtypes, and what it would
+    take as inferred."""
+    used = df.memory_usage(deep=True, index=False).sum()
+    inferred = sum(_inferred_nbytes(df[i]) for i in df.columns)
+
+    saved = 1 - used / inferred if inferred else 0.0
+    print(
+        f"{dataset}: {used / 2**20:.1f} MiB, "
+        f"down from {inferred / 2**20:.1f} MiB inferred ({saved:.0%} saved)"
+    )
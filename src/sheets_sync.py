@@ -0,0 +1,159 @@
+"""Incremental sync of a frame to a Google Sheet.
+
+The values last pushed to each sheet are kept as a local snapshot under SNAPSHOT_DIR;
+a sync diffs the frame against it and writes only the cells that changed, as A1 ranges
+batched into as few batchUpdate requests as BATCH_SIZE allows, retried with
+exponential backoff on rate limits and transient errors. Without a snapshot (or
+with full=True) the sheet is cleared and rewritten whole, as before.
+
+The client needs only Sheets' clear and batch_update, so a local fake can stand in."""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import pathlib
+from typing import Any, Protocol
+
+import pandas as pd
+
+from src.utils import with_retry
+
+SNAPSHOT_DIR = pathlib.Path("data/Sheets Snapshots")
+
+# Most ranges sent in a single batchUpdate request.
+BATCH_SIZE = 500
+
+
+class SheetsClient(Protocol):
+    def clear(self, spreadsheet_id: str, range_name: str) -> Any:
+        ...
+
+    def batch_update(self, spreadsheet_id: str, data: dict, **kwargs: Any) -> Any:
+        ...
+
+
+def to_values(df: pd.DataFrame) -> list[list[str]]:
+    """df as the rows of strings Sheets.from_frame sends, header first."""
+    # As objects first: a categorical can't be filled with a value not in its categories.
+    df = df.astype(object).where(df.notna(), "").astype(str)
+    return [list(map(str, df.columns)), *df.values.tolist()]
+
+
+def column_letters(col: int) -> str:
+    """The A1 letters of the 0-based column col: 0 is A, 26 is AA."""
+    letters = ""
+    col += 1
+    while col:
+        col, rem = divmod(col - 1, 26)
+        letters = chr(ord("A") + rem) + letters
+    return letters
+
+
+def a1_range(sheet_name: str, row: int, col: int, n_rows: int, n_cols: int) -> str:
+    """The A1 range of the n_rows by n_cols block at the 0-based (row, col)."""
+    start = f"{column_letters(col)}{row + 1}"
+    end = f"{column_letters(col + n_cols - 1)}{row + n_rows}"
+    return f"'{sheet_name}'!{start}:{end}"
+
+
+def _pad(values: list[list[str]], n_rows: int, n_cols: int) -> list[list[str]]:
+    return [
+        row + [""] * (n_cols - len(row))
+        for row in values + [[] for _ in range(n_rows - len(values))]
+    ]
+
+
+def diff_ranges(
+    old: list[list[str]], new: list[list[str]], sheet_name: str
+) -> dict[str, list[list[str]]]:
+    """The ranges of sheet_name to write to turn old's values into new's.
+
+    Each row's changes are written as the span from its first to its last changed
+    cell, and consecutive rows with the same span are merged into one block. Cells
+    old has but new doesn't are blanked."""
+    n_rows = max(len(old), len(new))
+    n_cols = max((len(i) for i in old + new), default=0)
+    old, new = _pad(old, n_rows, n_cols), _pad(new, n_rows, n_cols)
+
+    spans = []
+    for old_row, new_row in zip(old, new):
+        changed = [i for i, (a, b) in enumerate(zip(old_row, new_row)) if a != b]
+        spans.append((changed[0], changed[-1] + 1) if changed else None)
+
+    ranges = {}
+    row = 0
+    while row < n_rows:
+        span = spans[row]
+        if span is None:
+            row += 1
+            continue
+
+        end = row + 1
+        while end < n_rows and spans[end] == span:
+            end += 1
+
+        start_col, end_col = span
+        block = [i[start_col:end_col] for i in new[row:end]]
+        ranges[
+            a1_range(sheet_name, row, start_col, end - row, end_col - start_col)
+        ] = block
+        row = end
+
+    return ranges
+
+
+def snapshot_path(
+    spreadsheet_id: str, sheet_name: str, snapshot_dir: pathlib.Path = SNAPSHOT_DIR
+) -> pathlib.Path:
+    key = hashlib.sha256(f"{spreadsheet_id}|{sheet_name}".encode()).hexdigest()[:16]
+    return pathlib.Path(snapshot_dir) / f"{key}.json"
+
+
+def read_snapshot(path: pathlib.Path) -> list[list[str]] | None:
+    try:
+        return json.loads(path.read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def write_snapshot(values: list[list[str]], path: pathlib.Path):
+    """Atomically writes values as the snapshot at path."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    tmp_path.write_text(json.dumps(values))
+    tmp_path.replace(path)
+
+
+def sync_frame(
+    sheets: SheetsClient,
+    spreadsheet_id: str,
+    sheet_name: str,
+    df: pd.DataFrame,
+    full: bool = False,
+    snapshot_dir: pathlib.Path = SNAPSHOT_DIR,
+    batch_size: int = BATCH_SIZE,
+) -> int:
+    """Writes df to sheet_name, sending only the cells changed since the last sync.
+    The snapshot is only updated once every batch is written, so a failed sync is
+    simply redone by the next. Returns the number of ranges written."""
+    values = to_values(df)
+    path = snapshot_path(spreadsheet_id, sheet_name, snapshot_dir)
+
+    old = None if full else read_snapshot(path)
+    if old is None:
+        with_retry(lambda: sheets.clear(spreadsheet_id, sheet_name))
+        old = []
+
+    ranges = list(diff_ranges(old, values, sheet_name).items())
+
+    for i in range(0, len(ranges), batch_size):
+        batch = dict(ranges[i : i + batch_size])
+        with_retry(
+            lambda: sheets.batch_update(spreadsheet_id, batch, align_columns=False)
+        )
+
+    write_snapshot(values, path)
+    print(f"Synced {len(ranges)} ranges to {sheet_name}")
+
+    return len(ranges)
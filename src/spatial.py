@@ -0,0 +1,234 @@
+from __future__ import annotations
+
+import functools
+import math
+import os
+import pathlib
+from concurrent.futures import ProcessPoolExecutor
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+from src.utils import file_fingerprint, hash_parts, read_cached
+
+CRS = "EPSG:4269"
+
+# District attributes written back to each row, and the names they're written as.
+DISTRICT_COLUMNS = {"GEOID": "GEOID", "NAME": "District Name"}
+
+POINT_CHUNKSIZE = 50_000
+
+# Decimal places coordinates are rounded to before lookup, ~0.1m.
+COORD_DECIMALS = 6
+
+# Version of the persisted district index's format.
+INDEX_VERSION = 1
+
+# The district index each worker process queries; see _init_worker.
+_districts: gpd.GeoDataFrame | None = None
+
+
+def read_districts(
+    school_districts_path: pathlib.Path, columns: list[str]
+) -> pd.DataFrame:
+    """Reads the district polygons, reprojected to CRS, keeping only columns and the
+    geometry (as WKB, so that the frame can be cached as plain Parquet)."""
+    gdf = gpd.read_file(school_districts_path).to_crs(CRS)
+
+    df = pd.DataFrame(gdf[columns])
+    df["geometry"] = gdf.geometry.to_wkb()
+    return df
+
+
+def load_district_index(
+    school_districts_path: pathlib.Path,
+    columns: list[str] = list(DISTRICT_COLUMNS),
+) -> gpd.GeoDataFrame:
+    """Loads the district polygons, parsing the shapefile only once per download:
+    thereafter they're read from a Parquet copy persisted next to it."""
+    df = read_cached(
+        school_districts_path,
+        reader=functools.partial(read_districts, columns=columns),
+        version=hash_parts(INDEX_VERSION, CRS, columns),
+    )
+    return gpd.GeoDataFrame(
+        df.drop(columns="geometry"),
+        geometry=gpd.GeoSeries.from_wkb(df["geometry"], crs=CRS),
+    )
+
+
+def prepare_district_index(school_districts_path: pathlib.Path) -> pathlib.Path:
+    """Builds and persists the district index of school_districts_path, if need be."""
+    load_district_index(school_districts_path)
+    return pathlib.Path(school_districts_path)
+
+
+def _init_worker(school_districts_path: pathlib.Path, columns: list[str]):
+    global _districts
+
+    _districts = load_district_index(school_districts_path, columns=columns)
+    # Builds the STRtree up front, once per worker.
+    _districts.sindex
+
+
+def _locate(districts: gpd.GeoDataFrame, coords: np.ndarray) -> np.ndarray:
+    """Positional index of the district containing each (longitude, latitude) pair of
+    coords, or -1 if there's none. A point within several districts, say an elementary
+    and a secondary one, or on a shared boundary, is given the first."""
+    points = gpd.points_from_xy(coords[:, 0], coords[:, 1], crs=CRS)
+    point_ixs, district_ixs = districts.sindex.query_bulk(
+        points, predicate="intersects"
+    )
+
+    order = np.lexsort((district_ixs, point_ixs))
+    point_ixs, district_ixs = point_ixs[order], district_ixs[order]
+    point_ixs, first_ixs = np.unique(point_ixs, return_index=True)
+
+    located = np.full(len(coords), -1)
+    located[point_ixs] = district_ixs[first_ixs]
+    return located
+
+
+def _locate_chunk(coords: np.ndarray) -> np.ndarray:
+    return _locate(_districts, coords)
+
+
+def locate_points(
+    coords: np.ndarray,
+    school_districts_path: pathlib.Path,
+    columns: dict[str, str] = DISTRICT_COLUMNS,
+    processes: int | None = None,
+    chunksize: int = POINT_CHUNKSIZE,
+) -> pd.DataFrame:
+    """The columns (renamed as given) of the district containing each
+    (longitude, latitude) pair of coords, NaN if none does.
+
+    The pairs are split into chunks of chunksize and located in parallel across processes,
+    each of which queries a spatial index of the persisted district polygons.
+    As each process loads the whole index, there are no more of them than chunks,
+    and a single chunk is located in this process."""
+    district_columns = list(columns)
+    districts = load_district_index(school_districts_path, columns=district_columns)
+
+    n_chunks = max(1, math.ceil(len(coords) / chunksize))
+
+    if n_chunks == 1:
+        located = _locate(districts, coords)
+    else:
+        with ProcessPoolExecutor(
+            max_workers=min(processes or os.cpu_count() or 1, n_chunks),
+            initializer=_init_worker,
+            initargs=(school_districts_path, district_columns),
+        ) as pool:
+            located = np.concatenate(
+                list(pool.map(_locate_chunk, np.array_split(coords, n_chunks)))
+            )
+
+    return (
+        pd.DataFrame(districts[district_columns])
+        .reset_index(drop=True)
+        .reindex(located)
+        .rename(columns=columns)
+        .reset_index(drop=True)
+    )
+
+
+def _read_lookup(lookup_dir: pathlib.Path, vintage: str) -> pd.DataFrame | None:
+    """The lookup table of the given district vintage; tables of any other vintage
+    are removed."""
+    lookup_path = lookup_dir / f"{vintage}.parquet"
+
+    if lookup_path.exists():
+        return pd.read_parquet(lookup_path)
+
+    for stale_path in lookup_dir.glob("*.parquet"):
+        stale_path.unlink()
+
+    return None
+
+
+def spatial_join(
+    df: pd.DataFrame,
+    school_districts_path: pathlib.Path,
+    columns: dict[str, str] = DISTRICT_COLUMNS,
+    processes: int | None = None,
+    chunksize: int = POINT_CHUNKSIZE,
+    key: str | None = None,
+    lookup_dir: pathlib.Path | None = None,
+) -> pd.DataFrame:
+    """Maps each row's (Latitude, Longitude) to the school district containing it,
+    adding the district's columns (renamed as given) to df.
+
+    Coordinates are rounded to COORD_DECIMALS, and each distinct point is located only once.
+    If lookup_dir is given, the located districts of each (key, point) are persisted there,
+    tagged with the district vintage (the shapefile's name and version), and only the
+    (key, point)s missing from it are located. A new vintage invalidates the whole table."""
+    on = ([key] if key is not None else []) + ["Longitude", "Latitude"]
+    rounded_on = [f"_{i}" for i in on]
+
+    df = df.assign(
+        **{f"_{i}": df[i].round(COORD_DECIMALS) if i != key else df[i] for i in on}
+    )
+    points_df = (
+        df[rounded_on]
+        .dropna()
+        .drop_duplicates()
+        .set_axis(on, axis=1)
+        .reset_index(drop=True)
+    )
+
+    lookup_df = None
+    if lookup_dir is not None:
+        lookup_dir = pathlib.Path(lookup_dir)
+        school_districts_path = pathlib.Path(school_districts_path)
+        vintage = hash_parts(
+            school_districts_path.name,
+            file_fingerprint(school_districts_path),
+            columns,
+            COORD_DECIMALS,
+        )
+        lookup_df = _read_lookup(lookup_dir, vintage)
+
+    if lookup_df is None:
+        lookup_df = points_df.iloc[:0].reindex(columns=on + list(columns.values()))
+
+    misses_df = pd.merge(points_df, lookup_df[on], on=on, how="left", indicator=True)
+    misses_df = misses_df.loc[misses_df["_merge"] == "left_only", on]
+
+    print(f"Locating {len(misses_df)} of {len(points_df)} points")
+
+    if len(misses_df):
+        coords = misses_df.drop_duplicates(["Longitude", "Latitude"])
+        located_df = locate_points(
+            coords[["Longitude", "Latitude"]].to_numpy(dtype=float),
+            school_districts_path=school_districts_path,
+            columns=columns,
+            processes=processes,
+            chunksize=chunksize,
+        )
+        located_df[["Longitude", "Latitude"]] = coords[
+            ["Longitude", "Latitude"]
+        ].to_numpy()
+        misses_df = pd.merge(
+            misses_df, located_df, on=["Longitude", "Latitude"], how="left"
+        )
+
+        lookup_df = pd.concat([lookup_df, misses_df], ignore_index=True)
+
+        if lookup_dir is not None:
+            lookup_dir.mkdir(parents=True, exist_ok=True)
+            # Written aside and then moved into place, so that an interrupted write
+            # can't leave a truncated lookup for the next run to read.
+            lookup_path = lookup_dir / f"{vintage}.parquet"
+            tmp_path = lookup_path.with_suffix(".tmp")
+            lookup_df.to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, lookup_path)
+
+    df = pd.merge(
+        df,
+        lookup_df.set_axis(rounded_on + list(columns.values()), axis=1),
+        on=rounded_on,
+        how="left",
+    )
+    return df.drop(columns=rounded_on)
@@ -0,0 +1,265 @@
+"""Seeded synthetic stand-ins for the pipeline's inputs, so that it can be run and
+benchmarked offline; see write_inputs. The shapes and cardinalities loosely follow
+the real datasets: a few line items per FRN, a single BEN (and so state) per FRN,
+duplicated FRN lines with a "Pending" status alongside another, and so on."""
+
+from __future__ import annotations
+
+import argparse
+import math
+import pathlib
+import shutil
+import tempfile
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely.geometry
+
+from src.form_471_dedup import RAW_PATH
+from src.spatial import CRS
+
+# fmt: off
+US_STATES = {
+    "AL": "Alabama", "AK": "Alaska", "AZ": "Arizona", "AR": "Arkansas",
+    "CA": "California", "CO": "Colorado", "CT": "Connecticut", "DE": "Delaware",
+    "DC": "District of Columbia", "FL": "Florida", "GA": "Georgia", "HI": "Hawaii",
+    "ID": "Idaho", "IL": "Illinois", "IN": "Indiana", "IA": "Iowa", "KS": "Kansas",
+    "KY": "Kentucky", "LA": "Louisiana", "ME": "Maine", "MD": "Maryland",
+    "MA": "Massachusetts", "MI": "Michigan", "MN": "Minnesota", "MS": "Mississippi",
+    "MO": "Missouri", "MT": "Montana", "NE": "Nebraska", "NV": "Nevada",
+    "NH": "New Hampshire", "NJ": "New Jersey", "NM": "New Mexico", "NY": "New York",
+    "NC": "North Carolina", "ND": "North Dakota", "OH": "Ohio", "OK": "Oklahoma",
+    "OR": "Oregon", "PA": "Pennsylvania", "RI": "Rhode Island",
+    "SC": "South Carolina", "SD": "South Dakota", "TN": "Tennessee", "TX": "Texas",
+    "UT": "Utah", "VT": "Vermont", "VA": "Virginia", "WA": "Washington",
+    "WV": "West Virginia", "WI": "Wisconsin", "WY": "Wyoming", "PR": "Puerto Rico",
+}
+# fmt: on
+
+# Statuses of each FRN line, before some are duplicated as "Pending".
+STATUSES = {
+    "Funded": 0.65,
+    "Pending": 0.05,
+    "Denied": 0.1,
+    "Cancelled": 0.1,
+    "Committed": 0.1,
+}
+
+ENTITY_TYPES = ["School", "School District", "Library", "Library System", "Consortium"]
+
+# (Longitude, latitude) bounds of the points and district polygons.
+BOUNDS = (-125.0, 25.0, -67.0, 49.0)
+
+# Share of FRN lines that are also listed as "Pending".
+PENDING_SHARE = 0.1
+
+
+def make_entities(n_entities: int, rng: np.random.Generator) -> pd.DataFrame:
+    """Supplemental entity data. About 5% of entities are listed more than once,
+    as they are when an entity's record is updated."""
+    numbers = np.arange(16_000_000, 16_000_000 + n_entities)
+    numbers = np.concatenate([numbers, rng.choice(numbers, n_entities // 20)])
+    n = len(numbers)
+
+    states = rng.choice(list(US_STATES), n_entities)
+    states = np.concatenate([states, states[numbers[n_entities:] - numbers[0]]])
+
+    x_min, y_min, x_max, y_max = BOUNDS
+    df = pd.DataFrame(
+        {
+            "Entity Number": numbers,
+            "Entity Name": [f"Entity {i}" for i in numbers],
+            "Entity Type": rng.choice(ENTITY_TYPES, n, p=[0.6, 0.2, 0.1, 0.05, 0.05]),
+            "Parent Entity Number": rng.choice(numbers[: max(1, n_entities // 10)], n),
+            "Physical County": [f"County {i}" for i in rng.integers(0, 3_000, n)],
+            "Physical State": states,
+            "Latitude": rng.uniform(y_min, y_max, n),
+            "Longitude": rng.uniform(x_min, x_max, n),
+            "Urban/ Rural Status": rng.choice(["Urban", "Rural"], n),
+            "NSLP Percentage": rng.integers(0, 101, n) / 100,
+            "Total Number of Full-Time Students": rng.integers(0, 3_000, n).astype(
+                float
+            ),
+            "Total Number of Part-Time Students": rng.integers(0, 100, n).astype(float),
+            "Peak Number of Part-Time Students": rng.integers(0, 100, n).astype(float),
+            "Number of NSLP Students": rng.integers(0, 2_000, n).astype(float),
+        }
+    )
+    df["Parent Entity Name"] = "Entity " + df["Parent Entity Number"].astype(str)
+
+    # Some entities were never geocoded.
+    df.loc[rng.random(n) < 0.02, ["Latitude", "Longitude"]] = np.nan
+
+    return df
+
+
+def _consulting_firms(n: int, rng: np.random.Generator) -> np.ndarray:
+    """Consulting Firm entries of n FRNs: most have none, the rest one to three firms."""
+    n_firms = max(10, n // 200)
+    firms = np.array([f"{{Firm {i}, LLC|{17_000_000 + i}}}" for i in range(n_firms)])
+
+    counts = rng.choice([0, 1, 2, 3], n, p=[0.6, 0.3, 0.07, 0.03])
+    entries = np.full(n, None, dtype=object)
+    for count in (1, 2, 3):
+        ixs = np.flatnonzero(counts == count)
+        picks = rng.integers(0, n_firms, (len(ixs), count))
+        entries[ixs] = [",".join(firms[i]) for i in picks]
+
+    return entries
+
+
+def make_ecf(
+    n_rows: int, entities_df: pd.DataFrame, rng: np.random.Generator
+) -> pd.DataFrame:
+    """About n_rows of ECF data, on BENs of entities_df."""
+    entities = entities_df.drop_duplicates("Entity Number", keep="last")
+
+    # FRNs average four line items, PENDING_SHARE of which are also listed as "Pending".
+    n_lines = int(n_rows / (1 + PENDING_SHARE))
+    n_frns = max(1, n_lines // 4)
+    frn_ixs = np.sort(rng.integers(0, n_frns, n_lines))
+    line_ixs = np.arange(n_lines) - np.searchsorted(frn_ixs, frn_ixs)
+
+    # Larger entities file more FRNs.
+    weights = rng.lognormal(0, 1.5, len(entities))
+    frn_bens = entities.iloc[
+        rng.choice(len(entities), n_frns, p=weights / weights.sum())
+    ]
+
+    frns = np.array([f"ECF2{i:09d}" for i in range(n_frns)])
+    frn_firms = _consulting_firms(n_frns, rng)
+
+    df = pd.DataFrame(
+        {
+            "Funding Request Number (FRN)": frns[frn_ixs],
+            "FRN Line Item ID": [
+                f"{frns[i]}.{j + 1:03d}" for i, j in zip(frn_ixs, line_ixs)
+            ],
+            "Funding Request Status": rng.choice(
+                list(STATUSES), n_lines, p=list(STATUSES.values())
+            ),
+            "Consulting Firm": frn_firms[frn_ixs],
+            "Billed Entity Number (BEN)": frn_bens["Entity Number"].to_numpy()[frn_ixs],
+            "Urban/ Rural Status": frn_bens["Urban/ Rural Status"].to_numpy()[frn_ixs],
+            "NSLP Percentage": frn_bens["NSLP Percentage"].to_numpy()[frn_ixs],
+            "Billed Entity State": frn_bens["Physical State"].to_numpy()[frn_ixs],
+            "Line Total Cost": rng.lognormal(7, 1.5, n_lines).round(2),
+            "Funding Request Narrative": "Laptops and hotspots for off-campus use.",
+        }
+    )
+
+    pending = df[
+        (rng.random(n_lines) < PENDING_SHARE)
+        & (df["Funding Request Status"] != "Pending")
+    ].assign(**{"Funding Request Status": "Pending"})
+    df = pd.concat([df, pending]).sort_index(kind="stable")
+
+    return df.reset_index(drop=True)
+
+
+def make_form_471(entities_df: pd.DataFrame, rng: np.random.Generator) -> pd.DataFrame:
+    """One to three Form 471s per billed entity, as in the raw basic information."""
+    bens = entities_df["Entity Number"].unique()
+    bens = np.repeat(bens, rng.integers(1, 4, len(bens)))
+    return pd.DataFrame(
+        {
+            "Billed Entity Number": bens,
+            "Funding Year": rng.choice([2018, 2019, 2020, 2021, 2022], len(bens)),
+            "Category One Discount Rate": rng.choice(
+                [20, 40, 50, 60, 80, 85, 90], len(bens)
+            ),
+            "Organization Name": "Organization",
+        }
+    )
+
+
+def make_discount_matrix() -> pd.DataFrame:
+    bands = ["0", "1-19", "20-34", "35-49", "50-74", "75-100"]
+    discounts = [20, 40, 50, 60, 80, 90]
+    return pd.DataFrame(
+        [(i, band, d) for i in ("Urban", "Rural") for band, d in zip(bands, discounts)],
+        columns=["Rural/Urban", "NSLP Percent", "Discount"],
+    )
+
+
+def make_state_names() -> pd.DataFrame:
+    return pd.DataFrame({"Name": US_STATES.values(), "Abbreviation": US_STATES.keys()})
+
+
+def make_districts(n_districts: int) -> gpd.GeoDataFrame:
+    """A grid of about n_districts rectangular districts tiling BOUNDS."""
+    side = max(1, math.isqrt(n_districts))
+    x_min, y_min, x_max, y_max = BOUNDS
+    xs, ys = np.linspace(x_min, x_max, side + 1), np.linspace(y_min, y_max, side + 1)
+
+    geoids = [f"{i * side + j:07d}" for i in range(side) for j in range(side)]
+    return gpd.GeoDataFrame(
+        {"GEOID": geoids, "NAME": [f"District {i}" for i in geoids]},
+        geometry=[
+            shapely.geometry.box(xs[i], ys[j], xs[i + 1], ys[j + 1])
+            for i in range(side)
+            for j in range(side)
+        ],
+        crs=CRS,
+    )
+
+
+def write_districts(gdf: gpd.GeoDataFrame, filepath: pathlib.Path):
+    """Writes gdf as a zipped shapefile, the format it's downloaded in."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        gdf.to_file(pathlib.Path(tmp_dir) / "districts.shp")
+        archive = shutil.make_archive(str(filepath.with_suffix("")), "zip", tmp_dir)
+
+    pathlib.Path(archive).replace(filepath)
+
+
+def write_inputs(
+    root: pathlib.Path,
+    n_rows: int,
+    seed: int = 0,
+    n_entities: int | None = None,
+    n_districts: int = 10_000,
+) -> dict[str, pathlib.Path]:
+    """Writes every input of the ECF pipeline under root, laid out as under the
+    repo's own data directory (the lookups at the paths the pipeline reads them from),
+    so that the pipeline can be run from root. Returns the path of each input."""
+    rng = np.random.default_rng(seed)
+    if n_entities is None:
+        n_entities = max(100, n_rows // 10)
+
+    data_dir = pathlib.Path(root) / "data"
+    data_dir.mkdir(parents=True, exist_ok=True)
+
+    paths = {
+        "ecf": data_dir / "ecf.csv",
+        "supp": data_dir / "supp.csv",
+        "form_471": data_dir / RAW_PATH.name,
+        "discount_matrix": data_dir / "ECF Discount Matrix.csv",
+        "state_names": data_dir / "us-states-names.csv",
+        "school_districts": data_dir / "districts.zip",
+    }
+
+    entities_df = make_entities(n_entities, rng)
+    make_ecf(n_rows, entities_df, rng).to_csv(paths["ecf"], index=False)
+    entities_df.to_csv(paths["supp"], index=False)
+    make_form_471(entities_df, rng).to_csv(paths["form_471"], index=False)
+    make_discount_matrix().to_csv(paths["discount_matrix"], index=False)
+    make_state_names().to_csv(paths["state_names"], index=False)
+    write_districts(make_districts(n_districts), paths["school_districts"])
+
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=write_inputs.__doc__)
+    parser.add_argument("root", type=pathlib.Path)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--districts", type=int, default=10_000)
+    args = parser.parse_args()
+
+    for name, path in write_inputs(
+        args.root, n_rows=args.rows, seed=args.seed, n_districts=args.districts
+    ).items():
+        print(f"{name}: {path}")
@@ -1,46 +1,199 @@
 import datetime
+import functools
+import glob
 import hashlib
+import json
 import os
 import pathlib
-from typing import Callable, Literal, Optional
+import time
+from typing import Any, Callable, Literal, Optional
 
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv
 import requests
+from googleapiclient.errors import HttpError
 
 OUT_DIR = "./data/"
 
+CHUNKSIZE = 100_000
+
+DOWNLOAD_CHUNKSIZE = 1 << 20
+
+
+def _interval_pairs(
+    a: np.ndarray, lo: np.ndarray, hi: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """Finds every pair of positions (i, j) such that lo[j] <= a[i] <= hi[j],
+    ordered by i and then j. NaN values never match.
+
+    Values and bounds are first replaced by their dense rank among all of them, and the
+    intervals are bucketed by their length in ranks, in powers of two. Within a bucket,
+    every interval is at least half as long as the longest, max_len, so searching the
+    intervals sorted by lower bound for those in [value - max_len, value] yields few
+    candidates beyond the intervals that actually contain the value, however wide or
+    overlapping the intervals of other buckets are. Candidates are then filtered on
+    their own upper bound."""
+    n, m = len(a), len(lo)
+
+    values = np.concatenate([a, lo, hi])
+    valid = ~pd.isna(values)
+    ranks = np.full(len(values), np.nan)
+    ranks[valid] = np.unique(values[valid], return_inverse=True)[1]
+    a, lo, hi = ranks[:n], ranks[n : n + m], ranks[n + m :]
+
+    ixs = np.flatnonzero(~np.isnan(a))
+    values = a[ixs]
+
+    intervals = np.flatnonzero(~(np.isnan(lo) | np.isnan(hi)) & (lo <= hi))
+    lengths = (hi - lo)[intervals]
+    buckets = np.where(lengths > 0, np.floor(np.log2(np.maximum(lengths, 1))) + 1, 0)
+
+    i_parts, j_parts = [], []
+    for bucket in np.unique(buckets):
+        in_bucket = intervals[buckets == bucket]
+        order = in_bucket[np.argsort(lo[in_bucket], kind="stable")]
+        lo_sorted, hi_sorted = lo[order], hi[order]
+        max_len = (hi_sorted - lo_sorted).max()
+
+        start = np.searchsorted(lo_sorted, values - max_len, side="left")
+        stop = np.searchsorted(lo_sorted, values, side="right")
+        counts = stop - start
+
+        i = np.repeat(ixs, counts)
+        offsets = np.arange(counts.sum()) - np.repeat(
+            np.cumsum(counts) - counts, counts
+        )
+        k = np.repeat(start, counts) + offsets
+
+        matched = hi_sorted[k] >= a[i]
+        i_parts.append(i[matched])
+        j_parts.append(order[k[matched]])
+
+    i = np.concatenate(i_parts) if i_parts else np.array([], dtype=np.intp)
+    j = np.concatenate(j_parts) if j_parts else np.array([], dtype=np.intp)
+
+    sort_ixs = np.lexsort((j, i))
+    return i[sort_ixs], j[sort_ixs]
+
+
+def _group_codes(
+    left_keys: pd.DataFrame, right_keys: pd.DataFrame
+) -> tuple[np.ndarray, np.ndarray]:
+    """Labels each row of left_keys and right_keys with a shared group number;
+    rows with any NaN key are labelled NaN."""
+    keys = pd.concat(
+        [left_keys, right_keys.set_axis(left_keys.columns, axis=1)],
+        ignore_index=True,
+    )
+    codes = (
+        keys.groupby(list(keys.columns), sort=False, observed=True)
+        .ngroup()
+        .to_numpy(dtype=float)
+    )
+    codes[codes < 0] = np.nan
+
+    return codes[: len(left_keys)], codes[len(left_keys) :]
+
+
+def _grouped_keys(
+    a: np.ndarray,
+    lo: np.ndarray,
+    hi: np.ndarray,
+    left_groups: np.ndarray,
+    right_groups: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Folds group numbers into the interval keys so that a single interval search
+    only matches within a group: every value is replaced by its dense rank among all
+    values, offset by group * (number of distinct values). Ordering is preserved within
+    a group, and every key of one group sorts before every key of the next."""
+    values = np.concatenate([a, lo, hi])
+    groups = np.concatenate([left_groups, right_groups, right_groups])
+
+    keys = np.full(len(values), np.nan)
+    valid = ~(pd.isna(values) | np.isnan(groups))
+
+    uniques, ranks = np.unique(values[valid], return_inverse=True)
+    keys[valid] = groups[valid] * len(uniques) + ranks
+
+    n, m = len(a), len(lo)
+    return keys[:n], keys[n : n + m], keys[n + m :]
+
+
+def _take_or_nan(df: pd.DataFrame, ixs: np.ndarray) -> pd.DataFrame:
+    """Positional take where an index of -1 yields a row of NaNs."""
+    return df.reset_index(drop=True).reindex(ixs)
+
 
 def range_join(
     left: pd.DataFrame,
     right: pd.DataFrame,
     left_on: str,
     right_on: tuple[str, str],
-    how: str = "left",
-):
+    how: Literal["left", "inner", "right"] = "left",
+    by: str | list[str] | None = None,
+    left_by: str | list[str] | None = None,
+    right_by: str | list[str] | None = None,
+) -> pd.DataFrame:
+    """Joins each row of left to every row of right whose closed interval
+    [right_on[0], right_on[1]] contains left[left_on].
+
+    Sort-based, running in O((n + m) log(n + m) + k) time and memory linear in the
+    size of the output k, with a log factor for intervals of widely varying lengths
+    (see _interval_pairs), rather than materializing an n x m comparison matrix.
+    Overlapping intervals yield one output row per match; NaN keys or bounds never match.
+
+    by (or left_by and right_by, if the column names differ) adds equality keys:
+    a row only matches intervals whose by columns are equal to its own, as if
+    left and right were first split by those keys. Rows with a NaN equality key never match.
+
+    For how="left" and how="inner", the result keeps left's order and index;
+    for how="right" it keeps right's order and index."""
     lo_col, hi_col = right_on
 
-    a = left[left_on].values
-    bl, bh = right[lo_col].values, right[hi_col].values
+    a = left[left_on].to_numpy()
+    lo, hi = right[lo_col].to_numpy(), right[hi_col].to_numpy()
 
-    i, j = np.where((a[:, None] >= bl) & (a[:, None] <= bh))
+    if by is not None:
+        left_by = right_by = by
 
-    ix_name = "index" if left.index.name is None else left.index.name
+    if left_by is not None or right_by is not None:
+        to_list = lambda x: [x] if isinstance(x, str) else list(x)
+        left_groups, right_groups = _group_codes(
+            left[to_list(left_by)], right[to_list(right_by)]
+        )
+        a, lo, hi = _grouped_keys(a, lo, hi, left_groups, right_groups)
 
-    t_right = pd.concat(
-        [
-            left.iloc[i].reset_index(),
-            right.iloc[j].reset_index(drop=True),
-        ],
-        axis=1,
-    ).set_index(ix_name, drop=True)
+    i, j = _interval_pairs(a=a, lo=lo, hi=hi)
 
     if how == "left":
-        n = np.arange(len(left))
-        t_left = left.iloc[np.setdiff1d(n, i)]
-        return pd.concat([t_right, t_left]).sort_index()
-    elif how == "inner":
-        return t_right.sort_index()
+        unmatched = np.setdiff1d(np.arange(len(left)), i, assume_unique=False)
+        i = np.concatenate([i, unmatched])
+        j = np.concatenate([j, np.full(len(unmatched), -1)])
+
+        order = np.argsort(i, kind="stable")
+        i, j = i[order], j[order]
+    elif how == "right":
+        unmatched = np.setdiff1d(np.arange(len(right)), j, assume_unique=False)
+        i = np.concatenate([i, np.full(len(unmatched), -1)])
+        j = np.concatenate([j, unmatched])
+
+        order = np.lexsort((i, j))
+        i, j = i[order], j[order]
+    elif how != "inner":
+        raise ValueError(f"Unsupported join type: {how}")
+
+    if how == "right":
+        t_left = _take_or_nan(left, i)
+        t_right = right.iloc[j]
+        t_left.index = t_right.index
+    else:
+        t_left = left.iloc[i]
+        t_right = _take_or_nan(right, j)
+        t_right.index = t_left.index
+
+    return pd.concat([t_left, t_right], axis=1)
 
 
 def merge_n_drop(
@@ -49,6 +202,9 @@ def merge_n_drop(
     validate: Optional[str] = None,
     dup_cols_to_keep: Literal["left", "right", "both"] = "left",
     ensure_m1: bool = True,
+    plan: bool = False,
+    right_unique: bool = False,
+    categorize_keys: bool = False,
     **kwargs,
 ):
     """'Better' way to merge two dataframes - at least more intuitive.
@@ -95,9 +251,44 @@ def merge_n_drop(
 
     ensure_m1 does exactly what is says: ensures that there's a many-to-one
     relationship when executing the final join.
+
+    plan enables a lower-copy mode, for left or inner joins given left_on and right_on,
+    keeping duplicated columns from the left (other merges ignore it).
+    The final column set is resolved up front, and right is projected to its join keys
+    and the columns it adds before merging, so nothing is dropped or renamed afterwards.
+    If right's keys are unique - right_unique asserts so, skipping the validation -
+    the merge becomes a positional take of right's rows alongside left's,
+    in which, as in pd.merge, NaN keys match each other, and inner joins keep left's order.
+    categorize_keys further converts each pair of join keys to categoricals sharing
+    the same categories, so that they're matched by their integer codes.
     """
     left, right, *args = args
 
+    if (
+        plan
+        and not args
+        and dup_cols_to_keep == "left"
+        and how in ("left", "inner")
+        and "left_on" in kwargs
+        and "right_on" in kwargs
+        and kwargs.keys() <= {"left_on", "right_on", "suffixes"}
+    ):
+        to_list = lambda x: [x] if isinstance(x, str) else list(x)
+        left_on, right_on = to_list(kwargs["left_on"]), to_list(kwargs["right_on"])
+
+        # A right key that's also a left column would be suffixed by the merge.
+        if not set(right_on) & set(left.columns):
+            return _planned_merge(
+                left,
+                right,
+                left_on=left_on,
+                right_on=right_on,
+                how=how,
+                ensure_m1=ensure_m1 or validate == "m:1",
+                right_unique=right_unique,
+                categorize_keys=categorize_keys,
+            )
+
     if validate is None and ensure_m1:
         validate = (
             "m:1"
@@ -169,6 +360,144 @@ def merge_n_drop(
         return merged
 
 
+def _key_index(keys: pd.DataFrame) -> pd.Index:
+    if len(keys.columns) == 1:
+        return pd.Index(keys.iloc[:, 0])
+    return pd.MultiIndex.from_frame(keys)
+
+
+def _shared_categorical_keys(
+    left_keys: pd.DataFrame, right_keys: pd.DataFrame
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Converts each pair of key columns to categoricals with the same categories."""
+    left_keys, right_keys = left_keys.copy(), right_keys.copy()
+
+    for l_col, r_col in zip(left_keys.columns, right_keys.columns):
+        categories = pd.Index(
+            pd.concat([left_keys[l_col], right_keys[r_col]], ignore_index=True)
+            .dropna()
+            .unique()
+        )
+        left_keys[l_col] = pd.Categorical(left_keys[l_col], categories=categories)
+        right_keys[r_col] = pd.Categorical(right_keys[r_col], categories=categories)
+
+    return left_keys, right_keys
+
+
+def _planned_merge(
+    left: pd.DataFrame,
+    right: pd.DataFrame,
+    left_on: list[str],
+    right_on: list[str],
+    how: str,
+    ensure_m1: bool,
+    right_unique: bool,
+    categorize_keys: bool,
+) -> pd.DataFrame:
+    """See merge_n_drop's plan."""
+    new_cols = [i for i in right.columns if i not in left.columns and i not in right_on]
+    right = right[right_on + new_cols]
+
+    left_keys, right_keys = left[left_on], right[right_on]
+    if categorize_keys:
+        left_keys, right_keys = _shared_categorical_keys(left_keys, right_keys)
+
+    right_index = _key_index(right_keys)
+
+    if not right_unique and not right_index.is_unique:
+        if ensure_m1:
+            raise pd.errors.MergeError(
+                "Merge keys are not unique in right dataset; not a many-to-one merge"
+            )
+
+        left_keys.columns = right_keys.columns = [
+            f"__key_{i}" for i in range(len(left_on))
+        ]
+        merged = pd.merge(
+            pd.concat([left, left_keys], axis=1, copy=False),
+            pd.concat([right[new_cols], right_keys], axis=1, copy=False),
+            on=list(left_keys.columns),
+            how=how,
+            copy=False,
+        )
+        return merged.drop(columns=left_keys.columns)
+
+    ixs = right_index.get_indexer(_key_index(left_keys))
+
+    if how == "inner":
+        left = left[ixs >= 0]
+        ixs = ixs[ixs >= 0]
+
+    right = right[new_cols].reset_index(drop=True)
+    taken = right.take(ixs) if (ixs >= 0).all() else right.reindex(ixs)
+    taken.index = left.index
+
+    merged = pd.concat([left, taken], axis=1, copy=False)
+    merged.index = pd.RangeIndex(len(merged))
+
+    return merged
+
+
+def check_columns(df: pd.DataFrame, columns: list[str], stage: str = ""):
+    """Raises a KeyError naming any of columns that df is missing."""
+    if missing := [i for i in columns if i not in df.columns]:
+        raise KeyError(f"{stage} requires missing columns: {missing}")
+
+
+def hash_parts(*parts) -> str:
+    """Short, stable hash of the repr of parts; used to version cached data."""
+    h = hashlib.new("sha256")
+    h.update(repr(parts).encode())
+    return h.hexdigest()[:16]
+
+
+# HTTP statuses worth retrying: rate limits and transient server errors.
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+RETRIES = 5
+BACKOFF_S = 1.0
+
+
+def with_retry(
+    fn: Callable[[], Any], retries: int = RETRIES, backoff_s: float = BACKOFF_S
+) -> Any:
+    """Calls fn, retrying it up to retries times on a retryable HttpError or a
+    connection error, waiting backoff_s, then twice that, and so on, in between."""
+    for attempt in range(retries + 1):
+        try:
+            return fn()
+        except (HttpError, ConnectionError, TimeoutError) as e:
+            retryable = not isinstance(e, HttpError) or e.status_code in RETRY_STATUSES
+            if not retryable or attempt == retries:
+                raise
+
+            wait_s = backoff_s * 2**attempt
+            print(f"Retrying in {wait_s:.1f}s after {type(e).__name__}: {e}")
+            time.sleep(wait_s)
+
+
+def file_fingerprint(filepath: pathlib.Path) -> str:
+    """Identifies a version of a file by its modification time and size."""
+    stat = os.stat(filepath)
+    return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+
+def file_digest(filepath: pathlib.Path) -> str:
+    """Identifies a version of a file by the hash of its contents, which unlike
+    file_fingerprint survives it being copied or re-downloaded unchanged."""
+    h = hashlib.new("sha256")
+    with open(filepath, "rb") as f:
+        while chunk := f.read(DOWNLOAD_CHUNKSIZE):
+            h.update(chunk)
+    return h.hexdigest()[:16]
+
+
+def frame_fingerprint(df: pd.DataFrame) -> str:
+    """Identifies a frame by its columns and the hash of its contents."""
+    row_hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    return hash_parts(list(df.columns), len(df), row_hashes.sum())
+
+
 def make_hashed_filename(s: str, out_dir: str):
     h = hashlib.new("sha256")
     h.update(s.encode())
@@ -178,6 +507,77 @@ def make_hashed_filename(s: str, out_dir: str):
 date_to_ymd: Callable[[datetime.datetime], str] = lambda x: x.strftime("%Y-%m-%d")
 
 
+def _meta_path(filepath: pathlib.Path) -> pathlib.Path:
+    return filepath.with_name(f"{filepath.name}.meta.json")
+
+
+def _read_meta(filepath: pathlib.Path) -> dict:
+    """HTTP validators (ETag, Last-Modified) and the last time filepath was checked
+    against its source, if recorded."""
+    meta_path = _meta_path(filepath)
+    return json.loads(meta_path.read_text()) if meta_path.exists() else {}
+
+
+def _write_meta(filepath: pathlib.Path, meta: dict):
+    _meta_path(filepath).write_text(json.dumps(meta))
+
+
+def _stream_download(
+    url: str,
+    filepath: pathlib.Path,
+    headers: dict[str, str],
+    chunk_size: int = DOWNLOAD_CHUNKSIZE,
+) -> bool:
+    """Streams url into a ".part" file next to filepath, chunk_size bytes at a time.
+    An existing ".part" file left by an interrupted transfer is resumed with a Range
+    request, guarded by If-Range so a changed source restarts from scratch.
+
+    Returns False if the server answered 304 Not Modified to the conditional headers;
+    otherwise the completed ".part" file is left for the caller to move into place."""
+    part_path = filepath.with_name(f"{filepath.name}.part")
+    part_meta = _read_meta(part_path)
+
+    request_headers = dict(headers)
+    offset = part_path.stat().st_size if part_path.exists() else 0
+
+    if offset and (
+        validator := part_meta.get("etag") or part_meta.get("last_modified")
+    ):
+        request_headers["Range"] = f"bytes={offset}-"
+        request_headers["If-Range"] = validator
+
+    with requests.get(url, headers=request_headers, stream=True, timeout=60) as r:
+        if r.status_code == 304:
+            part_path.unlink(missing_ok=True)
+            _meta_path(part_path).unlink(missing_ok=True)
+            return False
+
+        if r.status_code == 416:
+            # Our partial file doesn't fit the source anymore.
+            part_path.unlink()
+            return _stream_download(
+                url, filepath, headers=headers, chunk_size=chunk_size
+            )
+
+        r.raise_for_status()
+
+        resumed = r.status_code == 206
+        if not resumed:
+            _write_meta(
+                part_path,
+                {
+                    "etag": r.headers.get("ETag"),
+                    "last_modified": r.headers.get("Last-Modified"),
+                },
+            )
+
+        with open(part_path, "ab" if resumed else "wb") as file:
+            for chunk in r.iter_content(chunk_size=chunk_size):
+                file.write(chunk)
+
+    return True
+
+
 def GET_if_not_exists(
     url: str,
     filepath: Optional[str] = None,
@@ -189,6 +589,12 @@ def GET_if_not_exists(
     If it's already been downloaded within days_until_stale,
     we use that version instead.
 
+    Downloads are streamed to a temporary file and atomically moved into place once
+    complete, and an interrupted download is resumed on the next call.
+    A stale file is revalidated with a conditional GET (If-None-Match/If-Modified-Since),
+    so an unchanged source costs one round trip; otherwise the stale file is kept,
+    renamed with its modification date.
+
     Return the output path and whether or not the file's been downloaded."""
     if filepath is None:
         filepath = make_hashed_filename(s=url, out_dir=out_dir)
@@ -197,20 +603,257 @@ def GET_if_not_exists(
     filepath: pathlib.Path = pathlib.Path(filepath)
 
     download = not filepath.exists()
+    headers = {}
 
     if not download and days_until_stale is not None:
-        modified_time = datetime.datetime.fromtimestamp(os.path.getmtime(filepath))
+        meta = _read_meta(filepath)
+
+        checked_time = datetime.datetime.fromtimestamp(
+            meta.get("checked", os.path.getmtime(filepath))
+        )
         today = datetime.datetime.today()
-        delta = today - modified_time
+        delta = today - checked_time
 
         if download := delta.days >= days_until_stale:
-            filepath.rename(
-                filepath.with_stem(f"{filepath.stem} - {date_to_ymd(modified_time)}")
-            )
+            if etag := meta.get("etag"):
+                headers["If-None-Match"] = etag
+            if last_modified := meta.get("last_modified"):
+                headers["If-Modified-Since"] = last_modified
 
     if download:
-        r = requests.get(url)
-        with open(filepath, "wb") as file:
-            file.write(r.content)
+        download = _stream_download(url, filepath, headers=headers)
+
+        if download:
+            if filepath.exists():
+                modified_time = datetime.datetime.fromtimestamp(
+                    os.path.getmtime(filepath)
+                )
+                filepath.rename(
+                    filepath.with_stem(
+                        f"{filepath.stem} - {date_to_ymd(modified_time)}"
+                    )
+                )
+
+            part_path = filepath.with_name(f"{filepath.name}.part")
+            os.replace(part_path, filepath)
+            os.replace(_meta_path(part_path), _meta_path(filepath))
+
+        meta = _read_meta(filepath)
+        meta["checked"] = datetime.datetime.today().timestamp()
+        _write_meta(filepath, meta)
 
     return filepath, download
+
+
+def read_csv_chunked(
+    filepath: str | pathlib.Path,
+    dtype: Optional[dict[str, str]] = None,
+    usecols: Optional[list[str] | Callable[[str], bool]] = None,
+    chunk_fn: Optional[Callable[[pd.DataFrame], pd.DataFrame]] = None,
+    chunksize: int = CHUNKSIZE,
+    **kwargs,
+) -> pd.DataFrame:
+    """Reads a CSV chunksize rows at a time with a declared dtype schema.
+    Each chunk is projected to usecols while parsing and then passed through chunk_fn
+    (to filter or reduce it) before being kept, so with a chunk_fn peak memory is
+    bounded by the size of one raw chunk plus the already-reduced result rather than by
+    the size of the file. Without one every chunk is kept and then concatenated, so
+    peak memory is about twice the size of the parsed file."""
+    chunks = []
+
+    with pd.read_csv(
+        filepath, dtype=dtype, usecols=usecols, chunksize=chunksize, **kwargs
+    ) as reader:
+        for chunk in reader:
+            if chunk_fn is not None:
+                chunk = chunk_fn(chunk)
+            chunks.append(chunk)
+
+    if not chunks:
+        return pd.read_csv(filepath, dtype=dtype, usecols=usecols, nrows=0, **kwargs)
+
+    # Each chunk's categoricals only hold the categories seen in that chunk.
+    return concat_frames(chunks)
+
+
+def concat_frames(dfs: list[pd.DataFrame]) -> pd.DataFrame:
+    """Concatenates dfs, with a new index. A column that's categorical in the first
+    frame is kept categorical, with the union of the categories of every frame
+    (concatenating differing categoricals would otherwise fall back to object)."""
+    # Shallow copies, so that columns can be replaced without touching dfs' own.
+    dfs = [i.copy(deep=False) for i in dfs]
+
+    for col, col_dtype in dfs[0].dtypes.items():
+        if not isinstance(col_dtype, pd.CategoricalDtype) or not all(
+            isinstance(i[col].dtype, pd.CategoricalDtype) for i in dfs
+        ):
+            continue
+
+        categories = functools.reduce(
+            pd.Index.union, (i[col].cat.categories for i in dfs)
+        )
+        for i in dfs:
+            i[col] = i[col].cat.set_categories(categories)
+
+    return pd.concat(dfs, ignore_index=True)
+
+
+def cache_filepath(
+    filepath: str | pathlib.Path,
+    version: str = "",
+    fingerprint: Callable[[pathlib.Path], str] = file_fingerprint,
+) -> pathlib.Path:
+    """Path of the Parquet cache of filepath, keyed by the source's fingerprint
+    (by default its mtime and size) and version, which should identify the schema
+    the source is parsed with."""
+    filepath = pathlib.Path(filepath)
+
+    key = hash_parts(fingerprint(filepath), version)
+    return filepath.with_name(f"{filepath.name}.{key}.parquet")
+
+
+def write_cache(
+    df: pd.DataFrame,
+    filepath: str | pathlib.Path,
+    cache_path: pathlib.Path,
+    **kwargs,
+) -> bool:
+    """Atomically writes df to cache_path, replacing any previously cached copy of filepath.
+    kwargs are passed to to_parquet. Returns whether df could be cached."""
+    filepath = pathlib.Path(filepath)
+
+    for stale_path in filepath.parent.glob(f"{glob.escape(filepath.name)}.*.parquet"):
+        stale_path.unlink()
+
+    tmp_path = cache_path.with_suffix(".tmp")
+    try:
+        df.to_parquet(tmp_path, index=False, **kwargs)
+    except (TypeError, ValueError) as e:
+        # Columns of mixed Python types can't be stored as Parquet.
+        print(f"Could not cache {filepath}: {e}")
+        tmp_path.unlink(missing_ok=True)
+        return False
+
+    os.replace(tmp_path, cache_path)
+    return True
+
+
+def read_cached(
+    filepath: str | pathlib.Path,
+    reader: Callable[[pathlib.Path], pd.DataFrame],
+    version: str = "",
+    fingerprint: Callable[[pathlib.Path], str] = file_fingerprint,
+) -> pd.DataFrame:
+    """Reads filepath with reader, caching the parsed frame as Parquet next to it;
+    see cache_filepath.
+
+    A cache hit is memory-mapped instead of re-parsing the source; a change to either key
+    replaces any previously cached copy of the file."""
+    cache_path = cache_filepath(filepath, version=version, fingerprint=fingerprint)
+
+    if cache_path.exists():
+        return pd.read_parquet(cache_path, memory_map=True)
+
+    df = reader(pathlib.Path(filepath))
+    write_cache(df, filepath, cache_path)
+
+    return df
+
+
+OutputFormat = Literal["csv", "csv.gz", "csv.zst", "arrow_csv", "parquet"]
+
+# Leading bytes of each format read_output detects; anything else is read as CSV.
+_MAGIC_BYTES = {
+    b"PAR1": "parquet",
+    b"\x1f\x8b": "csv.gz",
+    b"\x28\xb5\x2f\xfd": "csv.zst",
+}
+
+OUTPUT_ROW_GROUP_SIZE = 100_000
+
+
+def output_format(filepath: str | pathlib.Path) -> OutputFormat:
+    """The format of an output written to filepath, by its suffix."""
+    suffix = pathlib.Path(filepath).suffix
+    return {".parquet": "parquet", ".gz": "csv.gz", ".zst": "csv.zst"}.get(
+        suffix, "csv"
+    )
+
+
+def arrow_table(df: pd.DataFrame) -> pa.Table:
+    """df as an Arrow table, without its index, whose categorical columns are decoded
+    to their values, as Arrow's CSV writer can't write dictionary columns."""
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    return table.cast(
+        pa.schema(
+            [
+                i.with_type(i.type.value_type) if pa.types.is_dictionary(i.type) else i
+                for i in table.schema
+            ]
+        )
+    )
+
+
+def write_output(
+    df: pd.DataFrame,
+    filepath: str | pathlib.Path,
+    format: OutputFormat | None = None,
+):
+    """Writes df to filepath in format, by default that of filepath's suffix; see output_format.
+
+    "csv" is pandas' CSV, as Tableau reads it, and "csv.gz" and "csv.zst" the same CSV,
+    compressed. "arrow_csv" is written by Arrow's multithreaded CSV writer, which
+    quotes every string. "parquet" is split into row groups of OUTPUT_ROW_GROUP_SIZE
+    with column statistics, so readers can skip the row groups they don't need."""
+    if format is None:
+        format = output_format(filepath)
+
+    if format == "csv":
+        df.to_csv(filepath, index=False)
+    elif format == "csv.gz":
+        df.to_csv(filepath, index=False, compression="gzip")
+    elif format == "csv.zst":
+        with pa.CompressedOutputStream(str(filepath), "zstd") as stream:
+            df.to_csv(stream, index=False, mode="wb")
+    elif format == "arrow_csv":
+        pyarrow.csv.write_csv(arrow_table(df), str(filepath))
+    elif format == "parquet":
+        df.to_parquet(
+            filepath,
+            index=False,
+            row_group_size=OUTPUT_ROW_GROUP_SIZE,
+            compression="zstd",
+            write_statistics=True,
+        )
+    else:
+        raise ValueError(f"Unsupported output format: {format}")
+
+
+def read_output(
+    filepath: str | pathlib.Path,
+    usecols: Optional[list[str]] = None,
+    dtype: Optional[dict[str, str]] = None,
+) -> pd.DataFrame:
+    """Reads an output written by write_output, detecting its format by its leading bytes."""
+    with open(filepath, "rb") as f:
+        head = f.read(4)
+    format = next((v for k, v in _MAGIC_BYTES.items() if head.startswith(k)), "csv")
+
+    if format == "parquet":
+        df = pd.read_parquet(filepath, columns=usecols)
+        if dtype is not None:
+            df = df.astype(
+                {k: v for k, v in dtype.items() if k in df.columns and df[k].dtype != v}
+            )
+        return df
+
+    if format == "csv.zst":
+        with pa.input_stream(str(filepath), compression="zstd") as stream:
+            return pd.read_csv(stream, usecols=usecols, dtype=dtype)
+
+    return pd.read_csv(
+        filepath,
+        usecols=usecols,
+        dtype=dtype,
+        compression="gzip" if format == "csv.gz" else None,
+    )
@@ -0,0 +1,12 @@
+import pytest
+
+from src.synthetic import write_inputs
+
+
+@pytest.fixture(scope="session")
+def synthetic_root(tmp_path_factory):
+    """A root with synthetic stand-ins for every input of the ECF pipeline, from which
+    the pipeline can be run (see src.synthetic)."""
+    root = tmp_path_factory.mktemp("synthetic")
+    write_inputs(root, n_rows=5_000, n_districts=500)
+    return root
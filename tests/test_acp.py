@@ -0,0 +1,38 @@
+import pathlib
+
+import pytest
+
+from src.acp import discover_pairs, file_period
+
+
+@pytest.mark.parametrize(
+    "name, period",
+    [
+        ("ACP-Claims-by-County-January-August-2023.csv", (2023, 1, 8)),
+        ("ACP-Claims-by-County-September-2023.csv", (2023, 9, 9)),
+        ("ACP-Households-by-County-January-December-2022.csv", (2022, 1, 12)),
+    ],
+)
+def test_file_period(name: str, period: tuple[int, int, int]):
+    assert file_period(pathlib.Path(name)) == period
+
+
+@pytest.mark.parametrize(
+    "name", ["ACP-Claims-by-County-Latest.csv", "ACP-Claims-by-County-Foo-2023.csv"]
+)
+def test_file_period_unparseable(name: str):
+    with pytest.raises(ValueError, match="Can't tell the period"):
+        file_period(pathlib.Path(name))
+
+
+def test_discover_pairs_skips_unparseable_names(tmp_path):
+    for period in ["January-August-2023", "September-2023", "Latest"]:
+        for kind in ["Claims", "Households"]:
+            (tmp_path / f"ACP-{kind}-by-County-{period}.csv").touch()
+
+    pairs = discover_pairs(tmp_path)
+
+    assert [claims.name for claims, _ in pairs] == [
+        "ACP-Claims-by-County-January-August-2023.csv",
+        "ACP-Claims-by-County-September-2023.csv",
+    ]
@@ -0,0 +1,41 @@
+import os
+
+import pytest
+
+from src.benchmark import SIZES, benchmarks, prepare
+
+pytestmark = pytest.mark.benchmark
+
+# e.g. BENCHMARK_SIZES=10000,100000 for a quicker run than the full range.
+BENCHMARK_SIZES = [
+    int(i) for i in os.environ.get("BENCHMARK_SIZES", "").split(",") if i.strip()
+] or SIZES
+
+NAMES = [
+    "dedeup_frns",
+    "range_join",
+    "merge_n_drop",
+    "merge_n_drop (plan)",
+    "join_nslp",
+    "spatial_join",
+]
+
+
+@pytest.fixture(scope="module", params=BENCHMARK_SIZES, ids=lambda i: f"{i:,}")
+def size_benchmarks(request, pytestconfig):
+    """The benchmarks of the inputs of a size, generated once under data/synthetic as
+    by python -m src.benchmark, and reused by later runs."""
+    root = prepare(request.param, pytestconfig.rootpath / "data/synthetic")
+
+    cwd = os.getcwd()
+    os.chdir(root)
+    try:
+        yield benchmarks()
+    finally:
+        os.chdir(cwd)
+
+
+@pytest.mark.parametrize("name", NAMES)
+def test_benchmark(benchmark, size_benchmarks, name):
+    benchmark.group = name
+    benchmark.pedantic(size_benchmarks[name], rounds=3, iterations=1)
@@ -0,0 +1,125 @@
+import gzip
+import itertools
+import os
+
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaUploadProgress
+
+from src import utils
+from src.drive_upload import upload_artifact, upload_artifacts
+
+CHUNK_SIZE = 256 * 1024
+
+
+class FakeUpload:
+    """A resumable upload session, sending the media chunk by chunk from the last
+    byte received. The chunks at the offsets in fail_at fail once with a 503."""
+
+    def __init__(self, drive, file_id: str, body: dict, media, fail_at: set[int]):
+        self.drive, self.file_id, self.body, self.media = drive, file_id, body, media
+        self.fail_at = set(fail_at)
+        self.received = b""
+
+    def next_chunk(self):
+        offset = len(self.received)
+        self.drive.chunk_offsets.append(offset)
+        if offset in self.fail_at:
+            self.fail_at.remove(offset)
+            raise HttpError(httplib2.Response({"status": 503}), b"Unavailable")
+
+        self.received += self.media.getbytes(offset, self.media.chunksize())
+        if len(self.received) < self.media.size():
+            return MediaUploadProgress(len(self.received), self.media.size()), None
+
+        self.drive.files[self.file_id] = {
+            **self.body,
+            "id": self.file_id,
+            "mimeType": self.media.mimetype(),
+            "data": self.received,
+        }
+        return None, {"id": self.file_id}
+
+
+class FakeDrive:
+    """Drive's files resource, as far as upload_artifact uses it."""
+
+    def __init__(self, fail_at: set[int] = frozenset()):
+        self.files: dict[str, dict] = {}
+        self.fail_at = fail_at
+        self.chunk_offsets = []
+        self.uploads = 0
+        self.ids = itertools.count()
+
+    def list(self, q: str, **kwargs):
+        name = q.split("'")[1]
+        files = [i for i in self.files.values() if i["name"] == name]
+        return type("Request", (), {"execute": lambda self: {"files": files}})()
+
+    def create(self, body: dict, media_body, **kwargs):
+        self.uploads += 1
+        file_id = f"id{next(self.ids)}"
+        return FakeUpload(self, file_id, body, media_body, self.fail_at)
+
+    def update(self, fileId: str, body: dict, media_body, **kwargs):
+        self.uploads += 1
+        return FakeUpload(self, fileId, body, media_body, self.fail_at)
+
+
+@pytest.fixture
+def no_sleep(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(utils.time, "sleep", sleeps.append)
+    return sleeps
+
+
+def test_upload_artifact_skips_unchanged(tmp_path):
+    filepath = tmp_path / "out.csv"
+    filepath.write_text("a,b\n1,2\n")
+    drive = FakeDrive()
+
+    uploaded = upload_artifact(drive, filepath, "folder")
+    assert drive.files[uploaded["id"]]["data"] == filepath.read_bytes()
+    assert upload_artifact(drive, filepath, "folder") is None
+    assert drive.uploads == 1
+
+    # Changed: the same Drive file is updated.
+    filepath.write_text("a,b\n3,4\n")
+    assert upload_artifact(drive, filepath, "folder") == uploaded
+    assert drive.uploads == 2 and len(drive.files) == 1
+    assert drive.files[uploaded["id"]]["data"] == filepath.read_bytes()
+
+
+def test_upload_artifact_resumes_failed_chunk(tmp_path, no_sleep):
+    filepath = tmp_path / "out.csv"
+    filepath.write_bytes(os.urandom(3 * CHUNK_SIZE + 1000))
+    drive = FakeDrive(fail_at={CHUNK_SIZE})
+
+    uploaded = upload_artifact(drive, filepath, "folder", chunk_size=CHUNK_SIZE)
+
+    assert drive.files[uploaded["id"]]["data"] == filepath.read_bytes()
+    # The failed chunk is resent, rather than the whole file.
+    assert drive.chunk_offsets == [
+        0,
+        CHUNK_SIZE,
+        CHUNK_SIZE,
+        2 * CHUNK_SIZE,
+        3 * CHUNK_SIZE,
+    ]
+    assert len(no_sleep) == 1
+
+
+def test_upload_artifacts_gzipped(tmp_path):
+    filepaths = [tmp_path / "a.csv", tmp_path / "b.csv"]
+    for i, filepath in enumerate(filepaths):
+        filepath.write_text(f"x,y\n{i},2\n" * 1000)
+    drive = FakeDrive()
+
+    uploaded = upload_artifacts(lambda: drive, filepaths, "folder", gzipped=True)
+
+    for filepath, file in zip(filepaths, uploaded):
+        sent = drive.files[file["id"]]
+        assert sent["name"] == f"{filepath.name}.gz"
+        assert sent["mimeType"] == "application/gzip"
+        assert gzip.decompress(sent["data"]) == filepath.read_bytes()
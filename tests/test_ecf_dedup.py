@@ -0,0 +1,261 @@
+import importlib
+import pathlib
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src import ecf_dedup
+from src.ecf_dedup import consulting_firms_table, dedeup_frns, join_consulting_firms
+from src.schemas import ECF_SCHEMA, apply_schema
+
+FRN = "Funding Request Number (FRN)"
+LINE = "FRN Line Item ID"
+STATUS = "Funding Request Status"
+
+
+def dedeup_frns_loop(ecf_df: pd.DataFrame):
+    """dedeup_frns as it was before it was vectorized, for reference."""
+    frns = ecf_df.groupby(["Funding Request Number (FRN)", "FRN Line Item ID"])
+
+    drop_ixs = []
+
+    for frn, group_df in frns:
+        statuses = group_df["Funding Request Status"]
+        statuses_list = list(statuses)
+
+        if "Pending" in statuses_list and len(statuses_list) > 1:
+            pending_ixs = statuses[statuses == "Pending"].index
+            drop_ixs.extend(pending_ixs)
+
+    ecf_df = ecf_df.drop(drop_ixs, axis=0)
+
+    def split_firms(x: str):
+        items = x.split("},")
+
+        names, numbers = [], []
+
+        for i in items:
+            i = i.replace("{", "").replace("}", "")
+            name, number = i.split("|")
+
+            names.append(name)
+            numbers.append(number)
+
+        return ", ".join(names), ", ".join(numbers)
+
+    firm_ixs = ~ecf_df["Consulting Firm"].isnull()
+    firms = ecf_df.loc[firm_ixs, "Consulting Firm"]
+
+    (
+        ecf_df.loc[firm_ixs, "Consulting Firm Names"],
+        ecf_df.loc[firm_ixs, "Consulting Firm Numbers"],
+    ) = zip(*firms.apply(split_firms))
+
+    return ecf_df
+
+
+def ecf_frame(rows: list[tuple]) -> pd.DataFrame:
+    df = pd.DataFrame(rows, columns=[FRN, LINE, STATUS])
+    df["Consulting Firm"] = [
+        "{Firm A, LLC|17000001},{Firm B|17000002}" if i % 3 == 0 else None
+        for i in range(len(df))
+    ]
+    df["Line Total Cost"] = np.arange(len(df), dtype=float)
+    return df
+
+
+EDGE_CASES = [
+    # Pending alongside another status: the Pending row goes.
+    ("A", "A.1", "Pending"),
+    ("A", "A.1", "Funded"),
+    # Only Pending rows: all of them go.
+    ("B", "B.1", "Pending"),
+    ("B", "B.1", "Pending"),
+    # A single Pending row stays.
+    ("C", "C.1", "Pending"),
+    # A missing status ranks like any other non-Pending status.
+    ("D", "D.1", "Pending"),
+    ("D", "D.1", None),
+    ("E", "E.1", None),
+    ("E", "E.1", None),
+    # Rows with a missing key are never de-duplicated.
+    (None, "F.1", "Pending"),
+    (None, "F.1", "Funded"),
+    ("G", None, "Pending"),
+    ("G", None, "Pending"),
+    # Other statuses are all kept.
+    ("H", "H.1", "Funded"),
+    ("H", "H.1", "Denied"),
+    ("H", "H.2", "Funded"),
+]
+
+
+def random_ecf_frame(n: int, seed: int) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    frns = rng.choice([f"ECF{i}" for i in range(n // 4)] + [None], n)
+    lines = [
+        f"{i}.{j}" if i is not None else None
+        for i, j in zip(frns, rng.integers(0, 3, n))
+    ]
+    statuses = rng.choice(["Pending", "Funded", "Denied", "Committed", None], n)
+    return ecf_frame(list(zip(frns, lines, statuses)))
+
+
+@pytest.mark.parametrize(
+    "ecf_df",
+    [ecf_frame(EDGE_CASES), random_ecf_frame(2_000, seed=0)],
+    ids=["edge_cases", "random"],
+)
+@pytest.mark.parametrize("schema", [False, True], ids=["inferred", "schema"])
+def test_dedeup_frns_matches_loop(ecf_df: pd.DataFrame, schema: bool):
+    if schema:
+        ecf_df = apply_schema(ecf_df, ECF_SCHEMA)
+
+    expected = dedeup_frns_loop(ecf_df.copy())
+    result = dedeup_frns(ecf_df.copy())
+
+    pd.testing.assert_index_equal(result.index, expected.index)
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+
+
+def test_dedeup_frns_edge_cases():
+    result = dedeup_frns(ecf_frame(EDGE_CASES))
+
+    kept = [(frn, status) for frn, _, status in EDGE_CASES]
+    for dropped in [("A", "Pending"), ("B", "Pending"), ("D", "Pending")]:
+        kept.remove(dropped)
+    kept.remove(("B", "Pending"))
+
+    assert list(zip(result[FRN], result[STATUS])) == kept
+
+
+def test_dedeup_frns_status_precedence():
+    status_precedence = {"Pending": 0, "Denied": 1, "Funded": 2}
+    ecf_df = ecf_frame(
+        [
+            ("A", "A.1", "Denied"),
+            ("A", "A.1", "Funded"),
+            ("B", "B.1", "Pending"),
+            ("B", "B.1", "Denied"),
+            ("C", "C.1", "Denied"),
+            ("C", "C.1", "Denied"),
+        ]
+    )
+
+    for df in [ecf_df, apply_schema(ecf_df, ECF_SCHEMA)]:
+        result = dedeup_frns(df, status_precedence=status_precedence)
+
+        assert list(zip(result[FRN], result[STATUS])) == [
+            ("A", "Funded"),
+            ("B", "Denied"),
+            ("C", "Denied"),
+            ("C", "Denied"),
+        ]
+
+
+FIRMS = pd.Series(
+    [
+        "{Firm A, LLC|17000001},{Firm B|17000002}",
+        None,
+        "{Firm C|17000003}",
+        "{Firm A, LLC|17000001}, {Firm D & Co.|17000004},{E|5}",
+    ],
+    index=[10, 11, 12, 13],
+)
+
+
+@pytest.mark.parametrize("dtype", [object, ECF_SCHEMA["Consulting Firm"]])
+def test_join_consulting_firms(dtype: str):
+    result = join_consulting_firms(FIRMS.astype(dtype))
+
+    assert result.index.tolist() == [10, 12, 13]
+    assert result["Consulting Firm Names"].tolist() == [
+        "Firm A, LLC, Firm B",
+        "Firm C",
+        "Firm A, LLC,  Firm D & Co., E",
+    ]
+    assert result["Consulting Firm Numbers"].tolist() == [
+        "17000001, 17000002",
+        "17000003",
+        "17000001, 17000004, 5",
+    ]
+
+
+def test_join_consulting_firms_malformed():
+    with pytest.raises(ValueError, match="Malformed Consulting Firm entries"):
+        join_consulting_firms(pd.Series(["{Firm A|1},{Firm B}"]))
+
+
+def test_consulting_firms_table():
+    ecf_df = pd.DataFrame({FRN: ["A", "B", "C", "D"], "Consulting Firm": FIRMS.values})
+
+    result = consulting_firms_table(ecf_df)
+
+    assert result.values.tolist() == [
+        ["A", "Firm A, LLC", "17000001"],
+        ["A", "Firm B", "17000002"],
+        ["C", "Firm C", "17000003"],
+        ["D", "Firm A, LLC", "17000001"],
+        ["D", " Firm D & Co.", "17000004"],
+        ["D", "E", "5"],
+    ]
+
+
+def test_incremental_recomputes_after_helper_changes(
+    synthetic_root, tmp_path, monkeypatch, capsys
+):
+    """A change to code the stages call invalidates the snapshot, not only a change
+    to the lookups."""
+    monkeypatch.chdir(synthetic_root)
+    helper_path = tmp_path / "ecf_helper.py"
+    helper_path.write_text("VERSION = 1\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.setattr(sys, "dont_write_bytecode", True)
+    monkeypatch.delitem(sys.modules, "ecf_helper", raising=False)
+    monkeypatch.setattr(
+        ecf_dedup, "PIPELINE_MODULES", ecf_dedup.PIPELINE_MODULES + ["ecf_helper"]
+    )
+
+    ecf_df = ecf_dedup.load_ecf_data(pathlib.Path("data/ecf.csv"))
+
+    def run() -> str:
+        ecf_dedup.process_ecf_data_incremental(
+            ecf_df,
+            supp_path="data/supp.csv",
+            school_districts_path="data/districts.zip",
+            out_filepath=tmp_path / "out.csv",
+            snapshot_dir=tmp_path / "snapshot",
+        )
+        return capsys.readouterr().out
+
+    assert "No usable snapshot" in run()
+    assert "Reprocessing 0 changed FRN groups" in run()
+
+    helper_path.write_text("VERSION = 2\n")
+    importlib.reload(sys.modules["ecf_helper"])
+
+    assert "No usable snapshot" in run()
+
+
+@pytest.mark.parametrize("shard_by", ["state", "frn"])
+def test_sharded_matches_serial(synthetic_root, tmp_path, monkeypatch, shard_by: str):
+    monkeypatch.chdir(synthetic_root)
+    ecf_df = ecf_dedup.load_ecf_data(pathlib.Path("data/ecf.csv"))
+    kwargs = dict(supp_path="data/supp.csv", school_districts_path="data/districts.zip")
+
+    ecf_dedup.process_ecf_data(
+        ecf_df, out_filepath=tmp_path / "serial.csv", checkpoint_dir=None, **kwargs
+    )
+    ecf_dedup.process_ecf_data_sharded(
+        ecf_df,
+        out_filepath=tmp_path / "sharded.csv",
+        processes=3,
+        shard_by=shard_by,
+        **kwargs,
+    )
+
+    serial = (tmp_path / "serial.csv").read_bytes()
+    assert (tmp_path / "sharded.csv").read_bytes() == serial
+    assert serial.count(b"\n") > 1_000
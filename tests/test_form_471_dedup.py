@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.form_471_dedup import (
+    BEN,
+    CAT1_DISCOUNT,
+    FUNDING_YEAR,
+    dedup_form_471,
+    top_per_ben,
+)
+from src.schemas import FORM_471_SCHEMA, apply_schema
+
+
+@pytest.fixture
+def form_471_path(tmp_path):
+    rng = np.random.default_rng(0)
+    n = 600
+    df = pd.DataFrame(
+        {
+            # Few BENs, years and rates, so most rows tie with rows of other chunks.
+            BEN: rng.choice([1001, 1002, 1003, 1004, 1005, None], n),
+            FUNDING_YEAR: rng.choice([2021, 2022, None], n),
+            CAT1_DISCOUNT: rng.choice([40.0, 80.0, np.nan], n),
+            "Organization Name": [f"Org {i}" for i in range(n)],
+        }
+    )
+    path = tmp_path / "form_471.csv"
+    df.to_csv(path, index=False)
+    return path
+
+
+@pytest.mark.parametrize("chunksize", [2, 7, 64, 10_000])
+def test_dedup_form_471_matches_single_pass(form_471_path, chunksize: int):
+    expected = top_per_ben(
+        apply_schema(pd.read_csv(form_471_path), FORM_471_SCHEMA)
+    ).reset_index(drop=True)
+
+    result = dedup_form_471(form_471_path, chunksize=chunksize)
+
+    pd.testing.assert_frame_equal(result, expected)
+    # One row per BEN, the missing one included.
+    assert len(result) == 6 and result[BEN].isna().sum() == 1
+
+
+def test_dedup_form_471_usecols(form_471_path):
+    result = dedup_form_471(form_471_path, usecols=["Organization Name"], chunksize=7)
+
+    assert list(result.columns) == [
+        BEN,
+        FUNDING_YEAR,
+        CAT1_DISCOUNT,
+        "Organization Name",
+    ]
+
+
+def test_dedup_form_471_empty(tmp_path):
+    path = tmp_path / "form_471.csv"
+    path.write_text(f"{BEN},{FUNDING_YEAR},{CAT1_DISCOUNT}\n")
+
+    assert dedup_form_471(path).empty
@@ -0,0 +1,36 @@
+import importlib
+import sys
+
+import pandas as pd
+
+from src.pipeline import Stage, code_version, run_stages
+
+
+def write_helper(path, factor: int):
+    path.write_text(f"def scale(df):\n    return df * {factor}\n")
+
+
+def test_run_stages_reruns_after_helper_changes(tmp_path, monkeypatch):
+    """A stage whose fn is unchanged is rerun once code it calls changes."""
+    write_helper(tmp_path / "pipeline_helper.py", factor=2)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    # Otherwise the edit, of the same size and within the same second, could be
+    # reloaded from the stale bytecode.
+    monkeypatch.setattr(sys, "dont_write_bytecode", True)
+    monkeypatch.delitem(sys.modules, "pipeline_helper", raising=False)
+    helper = importlib.import_module("pipeline_helper")
+
+    def scale(df: pd.DataFrame) -> pd.DataFrame:
+        return helper.scale(df)
+
+    def run() -> pd.DataFrame:
+        stages = [Stage("scale", scale, version=code_version(["pipeline_helper"]))]
+        df = pd.DataFrame({"a": [1, 2]})
+        return run_stages(df, stages, "input", checkpoint_dir=tmp_path / "checkpoints")
+
+    assert run()["a"].tolist() == [2, 4]
+
+    write_helper(tmp_path / "pipeline_helper.py", factor=3)
+    importlib.reload(helper)
+
+    assert run()["a"].tolist() == [3, 6]
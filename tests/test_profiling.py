@@ -0,0 +1,37 @@
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pytest
+
+from src.profiling import Profiler
+
+
+def spin(n: int) -> int:
+    return sum(i * i for i in range(n))
+
+
+@pytest.mark.skipif(sys.platform != "linux", reason="resets /proc/self/clear_refs")
+def test_peak_rss_is_per_stage(tmp_path):
+    profiler = Profiler("test", enabled=True, profile_dir=tmp_path)
+
+    with profiler.stage("large"):
+        np.ones(2**25).sum()  # 256 MiB
+    with profiler.stage("small"):
+        np.ones(2**10).sum()
+
+    large, small = profiler.stages
+    assert large["peak_rss_scope"] == small["peak_rss_scope"] == "stage"
+    assert large["peak_rss_bytes"] - small["peak_rss_bytes"] > 2**27
+
+
+def test_children_cpu_is_counted(tmp_path):
+    profiler = Profiler("test", enabled=True, profile_dir=tmp_path)
+
+    with profiler.stage("pool"):
+        with ProcessPoolExecutor(max_workers=2) as pool:
+            list(pool.map(spin, [1_000_000] * 2))
+
+    (pool_stage,) = profiler.stages
+    assert pool_stage["children_cpu_s"] > pool_stage["cpu_s"]
+    assert pool_stage["children_peak_rss_bytes"] > 0
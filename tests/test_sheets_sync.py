@@ -0,0 +1,124 @@
+import functools
+import re
+
+import httplib2
+import pandas as pd
+from googleapiclient.errors import HttpError
+
+from src.process_usf import join_state_names
+from src.schemas import USF_SCHEMA, apply_schema
+from src import utils
+from src.sheets_sync import diff_ranges, sync_frame, to_values
+
+
+def test_to_values_unmatched_state(tmp_path):
+    states_path = tmp_path / "us-states-names.csv"
+    pd.DataFrame({"Name": ["Texas"], "Abbreviation": ["TX"]}).to_csv(
+        states_path, index=False
+    )
+    usf_df = apply_schema(
+        pd.DataFrame(
+            {"State": ["Texas", "American Samoa"], "Year": [2022, 2022], "Delta": 1.5}
+        ),
+        USF_SCHEMA,
+    )
+
+    df = join_state_names(usf_df, states_path)
+
+    assert to_values(df) == [
+        ["State", "Year", "Delta", "State Name", "State Abbreviation"],
+        ["Texas", "2022", "1.5", "Texas", "TX"],
+        ["American Samoa", "2022", "1.5", "", ""],
+    ]
+
+
+class FakeSheets:
+    """Records the requests sent to it, and applies them to its cells. The first
+    fail_first batch_update calls fail with a 429."""
+
+    def __init__(self, fail_first: int = 0):
+        self.cells: dict[tuple[int, int], str] = {}
+        self.calls = []
+        self.fail_first = fail_first
+
+    def clear(self, spreadsheet_id: str, range_name: str):
+        self.calls.append(("clear", range_name))
+        self.cells = {}
+
+    def batch_update(self, spreadsheet_id: str, data: dict, **kwargs):
+        if self.fail_first:
+            self.fail_first -= 1
+            raise HttpError(httplib2.Response({"status": 429}), b"Rate limited")
+
+        self.calls.append(("batch_update", list(data)))
+        for range_name, values in data.items():
+            start = re.match(r"'.*'!([A-Z]+)(\d+):", range_name)
+            col = functools.reduce(
+                lambda acc, ch: acc * 26 + ord(ch) - ord("A") + 1, start[1], 0
+            )
+            for i, row in enumerate(values):
+                for j, value in enumerate(row):
+                    self.cells[(int(start[2]) - 1 + i, col - 1 + j)] = value
+
+    def values(self) -> dict[tuple[int, int], str]:
+        return {k: v for k, v in self.cells.items() if v != ""}
+
+
+def expected_values(df: pd.DataFrame) -> dict[tuple[int, int], str]:
+    return {
+        (i, j): value
+        for i, row in enumerate(to_values(df))
+        for j, value in enumerate(row)
+        if value != ""
+    }
+
+
+def test_diff_ranges():
+    old = [["a", "b", "c"], ["1", "2", "3"], ["4", "5", "6"], ["7", "8", "9"]]
+    new = [["a", "b", "c"], ["1", "X", "3"], ["4", "Y", "6"], ["7"]]
+
+    assert diff_ranges(old, new, "Sheet1") == {
+        "'Sheet1'!B2:B3": [["X"], ["Y"]],
+        "'Sheet1'!B4:C4": [["", ""]],
+    }
+    assert diff_ranges(new, new, "Sheet1") == {}
+
+
+def test_sync_frame(tmp_path):
+    sheets = FakeSheets()
+    df = pd.DataFrame({"a": range(10), "b": [1.5] * 10, "c": ["x"] * 10})
+
+    def sync(df: pd.DataFrame) -> int:
+        sheets.calls = []
+        return sync_frame(
+            sheets, "id", "Sheet1", df, snapshot_dir=tmp_path, batch_size=2
+        )
+
+    # Without a snapshot, the sheet is cleared and written whole.
+    assert sync(df) == 1
+    assert sheets.calls[0] == ("clear", "Sheet1")
+    assert sheets.values() == expected_values(df)
+
+    # Unchanged: nothing is sent.
+    assert sync(df) == 0
+    assert sheets.calls == []
+
+    # Changed and shrunk: the changed cells are written, and the dropped ones blanked.
+    changed_df = df.iloc[:7].copy()
+    changed_df.loc[[2, 3], "b"] = 9.0
+    changed_df.loc[5, "c"] = None
+    assert sync(changed_df) == 3
+    assert [i[0] for i in sheets.calls] == ["batch_update", "batch_update"]
+    assert sheets.values() == expected_values(changed_df)
+
+
+def test_sync_frame_retries_rate_limits(tmp_path, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(utils.time, "sleep", sleeps.append)
+    sheets = FakeSheets(fail_first=2)
+    df = pd.DataFrame({"a": [1, 2]})
+
+    sync_frame(sheets, "id", "Sheet1", df, snapshot_dir=tmp_path)
+
+    assert len(sleeps) == 2 and sleeps[1] == 2 * sleeps[0]
+    assert sheets.values() == expected_values(df)
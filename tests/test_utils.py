@@ -0,0 +1,289 @@
+import datetime
+import http.server
+import socket
+import subprocess
+import sys
+import threading
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import pytest
+import requests
+
+from src.utils import DOWNLOAD_CHUNKSIZE, GET_if_not_exists, merge_n_drop, range_join
+
+
+def brute_force_pairs(a, lo, hi, how: str) -> list[tuple[int, int]]:
+    pairs = []
+    for i, value in enumerate(a):
+        matches = [j for j in range(len(lo)) if lo[j] <= value <= hi[j]]
+        pairs += [(i, j) for j in matches]
+        if how == "left" and not matches:
+            pairs.append((i, -1))
+
+    if how == "right":
+        matched = {j for _, j in pairs}
+        pairs += [(-1, j) for j in range(len(lo)) if j not in matched]
+        pairs.sort(key=lambda x: (x[1], x[0]))
+
+    return pairs
+
+
+@pytest.mark.parametrize("how", ["left", "inner", "right"])
+def test_range_join_matches_brute_force(how: str):
+    rng = np.random.default_rng(0)
+    for _ in range(100):
+        n, m = rng.integers(0, 30), rng.integers(0, 10)
+        a = rng.integers(0, 20, n).astype(float)
+        a[rng.random(n) < 0.2] = np.nan
+        lo = rng.integers(0, 20, m).astype(float)
+        # Overlapping intervals, of lengths from a point to the whole range.
+        hi = lo + rng.choice([0, 1, 3, 8, 20], m)
+        lo[rng.random(m) < 0.1] = np.nan
+
+        left = pd.DataFrame({"a": a, "x": np.arange(n)})
+        right = pd.DataFrame({"lo": lo, "hi": hi, "y": np.arange(m)})
+
+        result = range_join(left, right, "a", ("lo", "hi"), how=how)
+
+        pairs = list(
+            zip(result["x"].fillna(-1).astype(int), result["y"].fillna(-1).astype(int))
+        )
+        assert pairs == brute_force_pairs(a, lo, hi, how)
+
+
+def test_range_join_by():
+    left = pd.DataFrame({"a": [1.0, 5.0, 5.0, np.nan], "g": ["x", "x", "y", "x"]})
+    right = pd.DataFrame(
+        {"lo": [0.0, 4.0, 0.0], "hi": [10.0, 6.0, 10.0], "g": ["x", "x", "z"]}
+    )
+
+    result = range_join(left, right, "a", ("lo", "hi"), how="inner", by="g")
+
+    assert result.index.tolist() == [0, 1, 1]
+    assert result["lo"].tolist() == [0.0, 0.0, 4.0]
+
+
+def test_range_join_wide_and_narrow_intervals():
+    """One interval spanning every value must not make each value scan every
+    narrower interval below it."""
+    n = 200_000
+    lo = 2.0 * np.arange(n)
+    left = pd.DataFrame({"a": lo + 0.5})
+    right = pd.DataFrame({"lo": np.append(lo, 0.0), "hi": np.append(lo + 1, 2.0 * n)})
+
+    tracemalloc.start()
+    result = range_join(left, right, "a", ("lo", "hi"), how="inner")
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    # Each value is in its own narrow interval, and in the wide one.
+    assert len(result) == 2 * n
+    assert (result["lo"] <= result["a"]).all() and (result["a"] <= result["hi"]).all()
+    assert peak < 500 * 2**20
+
+
+PEAK_RSS_SCRIPT = """
+import re, sys
+from src.utils import read_csv_chunked
+
+def status(field):
+    with open("/proc/self/status") as f:
+        return int(re.search(field + r":\\s+(\\d+) kB", f.read()).group(1)) * 1024
+
+chunk_fn = (lambda chunk: chunk[chunk["a"] < 0.01]) if sys.argv[2] == "filter" else None
+baseline = status("VmRSS")
+df = read_csv_chunked(sys.argv[1], dtype="float64", chunk_fn=chunk_fn, chunksize=10_000)
+print(status("VmHWM") - baseline)
+"""
+
+
+def peak_rss_increase(filepath, chunk_fn: str) -> int:
+    """Bytes by which reading filepath raises the peak RSS of a fresh interpreter
+    (VmHWM rather than ru_maxrss, which a child inherits from its parent)."""
+    result = subprocess.run(
+        [sys.executable, "-c", PEAK_RSS_SCRIPT, str(filepath), chunk_fn],
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+    return int(result.stdout)
+
+
+@pytest.mark.skipif(sys.platform != "linux", reason="reads /proc/self/status")
+def test_read_csv_chunked_peak_rss(tmp_path):
+    n = 1_000_000
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(rng.random((n, 4)), columns=list("abcd"))
+    filepath = tmp_path / "large.csv"
+    df.to_csv(filepath, index=False)
+    size = df.memory_usage(index=False).sum()
+
+    # Filtered chunk by chunk, peak memory is bounded by a chunk, not the file.
+    assert peak_rss_increase(filepath, "filter") < size / 2
+
+    # Unfiltered, every chunk is kept and then concatenated: about twice the frame.
+    unfiltered = peak_rss_increase(filepath, "none")
+    assert size < unfiltered < 3 * size
+
+
+def random_merge_frames(seed: int, right_unique: bool):
+    rng = np.random.default_rng(seed)
+    keys = [f"k{i}" for i in range(20)] + [None]
+    left = pd.DataFrame(
+        {
+            "k": rng.choice(keys, 200),
+            "j": rng.choice([1.0, 2.0, np.nan], 200),
+            "x": np.arange(200),
+            "ok": "left",
+        }
+    )
+    n_right = len(keys) * 3
+    right = pd.DataFrame(
+        {
+            "rk": np.repeat(keys, 3),
+            "rj": np.tile([1.0, 2.0, np.nan], len(keys)),
+            "y": np.arange(n_right),
+            "ok": "right",
+        }
+    )
+    if not right_unique:
+        right = pd.concat([right, right.sample(20, random_state=seed)])
+    return left, right.sample(frac=1, random_state=seed)
+
+
+@pytest.mark.parametrize("how", ["left", "inner"])
+@pytest.mark.parametrize("on", [["k"], ["k", "j"]], ids=["one_key", "two_keys"])
+@pytest.mark.parametrize("right_unique", [True, False], ids=["unique", "duplicated"])
+@pytest.mark.parametrize("categorize_keys", [False, True], ids=["", "categorized"])
+def test_merge_n_drop_plan_matches_default(
+    how: str, on: list[str], right_unique: bool, categorize_keys: bool
+):
+    """NaN keys included, which match each other in both. Rows are compared in left's
+    order, which pd.merge doesn't keep for inner joins."""
+    left, right = random_merge_frames(seed=0, right_unique=right_unique)
+    if len(on) == 1:
+        right = right.drop_duplicates(["rk"]) if right_unique else right
+    right_on = ["r" + i for i in on]
+    kwargs = dict(left_on=on, right_on=right_on, how=how, ensure_m1=False)
+
+    expected = merge_n_drop(left, right, **kwargs)
+    result = merge_n_drop(
+        left, right, plan=True, categorize_keys=categorize_keys, **kwargs
+    )
+
+    def in_left_order(df: pd.DataFrame) -> pd.DataFrame:
+        return df.sort_values("x", kind="stable").reset_index(drop=True)
+
+    pd.testing.assert_frame_equal(
+        in_left_order(result), in_left_order(expected), check_dtype=False
+    )
+    assert result["k"].isna().any() and result["y"].notna().sum() > 0
+
+
+class FakeSource(http.server.BaseHTTPRequestHandler):
+    """Serves server.body with an ETag, honoring If-None-Match and Range/If-Range.
+    If server.fail_after is set, the next response is cut off after that many bytes."""
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+
+        if self.headers.get("If-None-Match") == server.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        start, status = 0, 200
+        if (range_ := self.headers.get("Range")) and self.headers.get(
+            "If-Range"
+        ) == server.etag:
+            start, status = int(range_.split("=")[1].rstrip("-")), 206
+
+        body = server.body[start:]
+        self.send_response(status)
+        self.send_header("ETag", server.etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+
+        if server.fail_after is not None:
+            self.wfile.write(body[: server.fail_after])
+            server.fail_after = None
+            self.wfile.flush()
+            self.connection.shutdown(socket.SHUT_RDWR)
+            return
+
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def source():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), FakeSource)
+    server.body, server.etag, server.fail_after = b"x" * 3 * 2**20, '"v1"', None
+    server.requests = []
+    server.url = f"http://127.0.0.1:{server.server_port}/data.csv"
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_get_if_not_exists_resumes_interrupted_download(source, tmp_path):
+    filepath = tmp_path / "data.csv"
+    source.fail_after = 5 * 2**19
+
+    with pytest.raises(requests.exceptions.RequestException):
+        GET_if_not_exists(source.url, filepath=filepath)
+    assert not filepath.exists()
+    # The chunks read in full before the connection dropped.
+    offset = (tmp_path / "data.csv.part").stat().st_size
+    assert offset == 2 * DOWNLOAD_CHUNKSIZE
+
+    assert GET_if_not_exists(source.url, filepath=filepath) == (filepath, True)
+    assert filepath.read_bytes() == source.body
+
+    resumed = source.requests[-1]
+    assert resumed["Range"] == f"bytes={offset}-" and resumed["If-Range"] == '"v1"'
+
+
+def test_get_if_not_exists_revalidates_stale_file(source, tmp_path):
+    filepath = tmp_path / "data.csv"
+    GET_if_not_exists(source.url, filepath=filepath)
+
+    # Fresh: no request at all.
+    assert GET_if_not_exists(source.url, filepath=filepath, days_until_stale=1) == (
+        filepath,
+        False,
+    )
+    assert len(source.requests) == 1
+
+    # Stale but unchanged: a 304, and the file is kept as is.
+    assert GET_if_not_exists(source.url, filepath=filepath, days_until_stale=0) == (
+        filepath,
+        False,
+    )
+    assert source.requests[-1]["If-None-Match"] == '"v1"'
+    assert filepath.read_bytes() == source.body
+    assert list(tmp_path.glob("*.csv")) == [filepath]
+
+
+def test_get_if_not_exists_rotates_changed_file(source, tmp_path):
+    filepath = tmp_path / "data.csv"
+    GET_if_not_exists(source.url, filepath=filepath)
+    old_body = source.body
+    source.body, source.etag = b"y" * 1_000, '"v2"'
+
+    assert GET_if_not_exists(source.url, filepath=filepath, days_until_stale=0) == (
+        filepath,
+        True,
+    )
+    assert filepath.read_bytes() == source.body
+
+    today = datetime.date.today().isoformat()
+    assert (tmp_path / f"data - {today}.csv").read_bytes() == old_body